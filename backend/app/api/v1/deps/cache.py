@@ -0,0 +1,112 @@
+from typing import Any, Optional
+import logging
+
+import msgpack
+from pydantic_core import to_jsonable_python
+from redis.asyncio import Redis
+
+from ....config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# REDIS CACHE (réponses des endpoints chauds, TTL court)
+# ============================================================================
+
+STATS_KEY = "stats:v1"
+
+
+def batch_key(batch_id: int) -> str:
+    return f"batch:{batch_id}"
+
+
+def topn_key(batch_id: int, strategy: str, n: int) -> str:
+    return f"topn:{batch_id}:{strategy}:{n}"
+
+
+def topn_index(batch_id: int) -> str:
+    """Redis set of the batch's cached top-N keys (invalidated together)"""
+    return f"topn-index:{batch_id}"
+
+
+class ResponseCache:
+    """Short-TTL response cache backed by Redis (msgpack payloads)
+
+    Disabled (every call is a no-op/miss) when REDIS_URL is not configured.
+    Redis errors are logged and treated as a miss so the DB stays the
+    source of truth.
+    """
+
+    def __init__(self, client: Optional[Redis]):
+        self.client = client
+
+    async def get(self, key: str) -> Optional[Any]:
+        if self.client is None:
+            return None
+        try:
+            raw = await self.client.get(key)
+        except Exception as exc:
+            logger.warning("Cache GET %s failed: %s", key, exc)
+            return None
+        return msgpack.unpackb(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Any, ttl: int, index: Optional[str] = None) -> None:
+        """Store value in pydantic JSON mode (Decimal → str, as in an uncached response)
+
+        With index, the key is also added to that Redis set (same TTL, one
+        pipelined round trip) so delete_indexed can drop it without a SCAN.
+        """
+        if self.client is None:
+            return
+        try:
+            payload = msgpack.packb(to_jsonable_python(value))
+            if index is None:
+                await self.client.set(key, payload, ex=ttl)
+                return
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.set(key, payload, ex=ttl)
+                pipe.sadd(index, key)
+                pipe.expire(index, ttl)
+                await pipe.execute()
+        except Exception as exc:
+            logger.warning("Cache SET %s failed: %s", key, exc)
+
+    async def delete(self, *keys: str) -> None:
+        if self.client is None or not keys:
+            return
+        try:
+            await self.client.delete(*keys)
+        except Exception as exc:
+            logger.warning("Cache DEL %s failed: %s", keys, exc)
+
+    async def delete_indexed(self, *indexes: str) -> None:
+        """Delete every key registered in the index sets, and the sets themselves
+
+        Two round trips (pipelined SMEMBERS, one DEL) whatever the keyspace size.
+        """
+        if self.client is None or not indexes:
+            return
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for index in indexes:
+                    pipe.smembers(index)
+                members = await pipe.execute()
+            await self.client.delete(*(key for keys in members for key in keys), *indexes)
+        except Exception as exc:
+            logger.warning("Cache DEL %s failed: %s", indexes, exc)
+
+
+_redis_client: Optional[Redis] = None
+
+
+def get_redis() -> Optional[Redis]:
+    """Process-wide async Redis client (lazily created, None if disabled)"""
+    global _redis_client
+    if _redis_client is None and settings.cache.redis_url:
+        _redis_client = Redis.from_url(settings.cache.redis_url)
+    return _redis_client
+
+
+def get_cache() -> ResponseCache:
+    """Dependency to get the response cache for FastAPI"""
+    return ResponseCache(get_redis())
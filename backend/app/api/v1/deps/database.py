@@ -1,36 +1,39 @@
 from typing import AsyncGenerator, Generator
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from ....core.database import get_db as get_sync_db, SessionLocal
-from ....config.settings import settings
+from ....core.database import AsyncSessionLocal, SessionLocal
 
 # ============================================================================
 # DATABASE SESSION (1 session par requête via yield)
 # ============================================================================
 
-# For Phase 1.3, we use sync sessions to match our repository layer
-# Future enhancement: Move to async SQLAlchemy for true async operations
+# Routers use native async sessions (asyncpg) so DB waits never block the
+# threadpool. FastAPI caches the dependency per request: sub-dependencies
+# declaring Depends(get_async_db_dependency) share the same session.
+# Sync repositories are driven through AsyncSession.run_sync().
+#
+# PgBouncer: with several uvicorn workers, point DATABASE_URL at PgBouncer in
+# transaction mode (e.g. ...@pgbouncer:6432/arbitragevault) and set
+# USE_PGBOUNCER=true. The engines then use NullPool (PgBouncer owns pooling)
+# and asyncpg statement caches are disabled, since consecutive transactions
+# may run on different backend sessions.
+
+async def get_async_db_dependency() -> AsyncGenerator[AsyncSession, None]:
+    """Dependency to get a native async database session for FastAPI
 
-def get_sync_db_dependency() -> Generator[Session, None, None]:
-    """Dependency to get synchronous database session for FastAPI
-    
     Provides 1 session per request via yield pattern.
     Session is automatically closed after request completion.
     """
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    async with AsyncSessionLocal() as session:
+        yield session
+
 
+def get_sync_db_dependency() -> Generator[Session, None, None]:
+    """Dependency to get synchronous database session (scripts/tooling)
 
-# Alternative async wrapper (future enhancement)
-async def get_async_db_dependency() -> AsyncGenerator[Session, None]:
-    """Async wrapper for database session
-    
-    Note: Currently wraps sync session for Phase 1.3 compatibility
-    Future: Replace with native async SQLAlchemy session
+    Provides 1 session per request via yield pattern.
+    Session is automatically closed after request completion.
     """
     db = SessionLocal()
     try:
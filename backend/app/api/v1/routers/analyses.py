@@ -1,25 +1,115 @@
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy.orm import Session
+from typing import Any, AsyncIterator, List, Optional, Tuple
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from datetime import datetime
 from decimal import Decimal
+import base64
+import json
 
-from ..deps.database import get_sync_db_dependency
+import orjson
+
+from ..deps.database import get_async_db_dependency
+from ..deps.cache import ResponseCache, get_cache, topn_key, topn_index
 from ..schemas.analysis import (
-    AnalysisOut, AnalysisCreateIn, AnalysisFilters, TopAnalysisParams
+    AnalysisOut, AnalysisCreateIn, AnalysisBulkOut, AnalysisFilters, TopAnalysisParams
 )
 from ..schemas.common import PageOut
 from ....repositories.analysis import AnalysisRepository
 from ....repositories.base import FilterCriteria, FilterCondition, Page
-from ....core.exceptions import map_exception_to_http, NotFoundError
-from ....models.batch import Batch
+from ....core.exceptions import map_exception_to_http, InvalidCursorError
+from ....models.analysis import Analysis
+from ....config.settings import settings
 
 router = APIRouter()
 
+# Validateur partagé : une seule passe pydantic pour toute la liste
+_ANALYSIS_LIST = TypeAdapter(List[AnalysisOut])
+
+# Au-delà de ce limit, la page est streamée (mémoire constante, TTFB court)
+_STREAM_THRESHOLD = 200
+_STREAM_CHUNK = 200
+
+
+def _threshold(value: float) -> Decimal:
+    """Float query threshold → exact Decimal bind (Decimal(40.3) would be 40.2999…)"""
+    return Decimal(str(value))
+
+
+def _encode_cursor(after: Tuple[Any, int], sort: Optional[str], sort_desc: bool) -> str:
+    """Opaque keyset cursor: base64(json([sort, sort_desc, sort_value, id]))"""
+    value, last_id = after
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    elif isinstance(value, Decimal):
+        value = str(value)
+    payload = json.dumps([sort, sort_desc, value, last_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def _decode_cursor(cursor: str, sort: Optional[str], sort_desc: bool) -> Tuple[Any, int]:
+    """Decode a cursor back to (sort_value, id) typed like the sort column
+    
+    The cursor is only valid for the sort it was taken with: reusing it with
+    another sort field or direction raises InvalidCursorError.
+    """
+    try:
+        cursor_sort, cursor_desc, value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise InvalidCursorError(f"Invalid pagination cursor: {cursor}")
+    if cursor_sort != sort or cursor_desc != sort_desc:
+        raise InvalidCursorError(
+            f"Pagination cursor was issued for sort={cursor_sort} sort_desc={cursor_desc}, "
+            f"not sort={sort} sort_desc={sort_desc}"
+        )
+    try:
+        column = Analysis.__table__.c.get(sort) if sort else None
+        if value is not None and column is not None:
+            python_type = column.type.python_type
+            value = datetime.fromisoformat(value) if python_type is datetime else python_type(value)
+        return value, int(last_id)
+    except Exception:
+        raise InvalidCursorError(f"Invalid pagination cursor: {cursor}")
+
+
+async def _stream_page(
+    bind: AsyncEngine,
+    stmt: Select,
+    meta: dict,
+    sort: Optional[str],
+    sort_desc: bool
+) -> AsyncIterator[bytes]:
+    """PageOut JSON rendu par morceaux : rows lues par partitions de yield_per
+    
+    Session dédiée : la session de la requête peut être fermée avant la fin
+    du streaming.
+    """
+    last = None
+    async with AsyncSession(bind, expire_on_commit=False) as session:
+        result = await session.stream_scalars(stmt.execution_options(yield_per=_STREAM_CHUNK))
+        yield b'{"items":['
+        async for partition in result.partitions():
+            rows = b",".join(
+                orjson.dumps(AnalysisOut.model_validate(item, from_attributes=True).model_dump(mode="json"))
+                for item in partition
+            )
+            yield rows if last is None else b"," + rows
+            last = partition[-1]
+    
+    if meta["has_next"] and last is not None:
+        meta["next_cursor"] = _encode_cursor((getattr(last, sort) if sort else None, last.id), sort, sort_desc)
+    else:
+        meta["next_cursor"] = None
+    yield b"]," + orjson.dumps(meta)[1:]
+
 
 @router.post("/", response_model=AnalysisOut, status_code=status.HTTP_201_CREATED)
 async def create_analysis(
     analysis_in: AnalysisCreateIn,
-    db: Session = Depends(get_sync_db_dependency)
+    db: AsyncSession = Depends(get_async_db_dependency),
+    cache: ResponseCache = Depends(get_cache)
 ):
     """Création d'analyse — admin/outil interne uniquement
     
@@ -28,13 +118,10 @@ async def create_analysis(
     """
     try:
         # Vérifier que le batch existe
-        batch = db.query(Batch).filter(Batch.id == analysis_in.batch_id).first()
-        if not batch:
-            raise NotFoundError("Batch", analysis_in.batch_id)
+        await db.run_sync(lambda session: AnalysisRepository(session).assert_batch_exists(analysis_in.batch_id))
         
-        # Créer l'analyse via repository
-        repo = AnalysisRepository(db)
-        analysis = repo.create_analysis(
+        # ✅ INSERT ... ON CONFLICT DO NOTHING RETURNING : doublon détecté atomiquement
+        analysis = await db.run_sync(lambda session: AnalysisRepository(session).upsert_returning(
             batch_id=analysis_in.batch_id,
             isbn_or_asin=analysis_in.isbn_or_asin,
             title=analysis_in.title,
@@ -46,31 +133,65 @@ async def create_analysis(
             risk_level=analysis_in.risk_level,
             bsr=analysis_in.bsr,
             raw_keepa=analysis_in.raw_keepa
-        )
+        ))
         
-        db.commit()
+        await db.commit()
+        await cache.delete_indexed(topn_index(analysis_in.batch_id))
         return analysis
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        raise map_exception_to_http(e)
+
+
+@router.post("/bulk", response_model=AnalysisBulkOut, status_code=status.HTTP_201_CREATED)
+async def create_analyses_bulk(
+    items: List[AnalysisCreateIn] = Body(..., min_length=1, max_length=1000),
+    db: AsyncSession = Depends(get_async_db_dependency),
+    cache: ResponseCache = Depends(get_cache)
+):
+    """Création en masse d'analyses — ingestion de batch
+    
+    Insère jusqu'à 1000 analyses en un seul INSERT multi-lignes et un seul
+    commit. Les doublons (batch_id, ISBN/ASIN) sont ignorés et comptés.
+    """
+    try:
+        batch_ids = {item.batch_id for item in items}
+        
+        def _insert(session):
+            repo = AnalysisRepository(session)
+            for batch_id in batch_ids:
+                repo.assert_batch_exists(batch_id)
+            return repo.bulk_insert([item.model_dump() for item in items])
+        
+        inserted = await db.run_sync(_insert)
+        await db.commit()
+        
+        await cache.delete_indexed(*(topn_index(batch_id) for batch_id in batch_ids))
+        
+        return AnalysisBulkOut(inserted=inserted, skipped=len(items) - inserted)
+        
+    except Exception as e:
+        await db.rollback()
         raise map_exception_to_http(e)
 
 
 @router.get("/", response_model=PageOut[AnalysisOut])
 async def list_analyses(
     batch_id: int = Query(..., description="Batch ID (required)"),
-    min_roi: Optional[Decimal] = Query(None, ge=0, description="Minimum ROI percentage"),
-    max_roi: Optional[Decimal] = Query(None, ge=0, description="Maximum ROI percentage"),
-    min_velocity: Optional[Decimal] = Query(None, ge=0, description="Minimum velocity score"),
-    max_velocity: Optional[Decimal] = Query(None, ge=0, description="Maximum velocity score"),
-    profit_min: Optional[Decimal] = Query(None, description="Minimum profit"),
-    profit_max: Optional[Decimal] = Query(None, description="Maximum profit"),
+    min_roi: Optional[float] = Query(None, ge=0, description="Minimum ROI percentage"),
+    max_roi: Optional[float] = Query(None, ge=0, description="Maximum ROI percentage"),
+    min_velocity: Optional[float] = Query(None, ge=0, description="Minimum velocity score"),
+    max_velocity: Optional[float] = Query(None, ge=0, description="Maximum velocity score"),
+    profit_min: Optional[float] = Query(None, description="Minimum profit"),
+    profit_max: Optional[float] = Query(None, description="Maximum profit"),
     isbn_list: Optional[str] = Query(None, description="Comma-separated ISBN/ASIN list"),
     sort: Optional[str] = Query("roi_percent", description="Sort field"),
     sort_desc: bool = Query(True, description="Sort descending"),
     offset: int = Query(0, ge=0, description="Offset for pagination"),
     limit: int = Query(50, ge=1, le=1000, description="Limit for pagination"),
-    db: Session = Depends(get_sync_db_dependency)
+    cursor: Optional[str] = Query(None, description="Keyset cursor (next_cursor of previous page)"),
+    db: AsyncSession = Depends(get_async_db_dependency)
 ):
     """Liste + filtres des analyses
     
@@ -78,15 +199,12 @@ async def list_analyses(
     - Filtres par ROI, velocity, profit (min/max)
     - Filtrage par liste d'ISBN/ASIN
     - Tri configurable avec validation
-    - Pagination avec offset/limit
+    - Pagination avec offset/limit, ou par curseur (keyset) via next_cursor
+    - limit > 200 : réponse streamée (même format PageOut)
     """
     try:
         # Vérifier que le batch existe
-        batch = db.query(Batch).filter(Batch.id == batch_id).first()
-        if not batch:
-            raise NotFoundError("Batch", batch_id)
-        
-        repo = AnalysisRepository(db)
+        await db.run_sync(lambda session: AnalysisRepository(session).assert_batch_exists(batch_id))
         
         # Construction des filtres
         filters = []
@@ -95,73 +213,114 @@ async def list_analyses(
             filters.append(FilterCriteria(
                 field="roi_percent",
                 condition=FilterCondition.GTE,
-                value=min_roi
+                value=_threshold(min_roi)
             ))
             
         if max_roi is not None:
             filters.append(FilterCriteria(
                 field="roi_percent",
                 condition=FilterCondition.LTE,
-                value=max_roi
+                value=_threshold(max_roi)
             ))
             
         if min_velocity is not None:
             filters.append(FilterCriteria(
                 field="velocity_score",
                 condition=FilterCondition.GTE,
-                value=min_velocity
+                value=_threshold(min_velocity)
             ))
             
         if max_velocity is not None:
             filters.append(FilterCriteria(
                 field="velocity_score",
                 condition=FilterCondition.LTE,
-                value=max_velocity
+                value=_threshold(max_velocity)
             ))
             
         if profit_min is not None:
             filters.append(FilterCriteria(
                 field="profit",
                 condition=FilterCondition.GTE,
-                value=profit_min
+                value=_threshold(profit_min)
             ))
             
         if profit_max is not None:
             filters.append(FilterCriteria(
                 field="profit",
                 condition=FilterCondition.LTE,
-                value=profit_max
+                value=_threshold(profit_max)
             ))
         
         # Parse ISBN list
         isbn_list_parsed = None
         if isbn_list:
-            isbn_list_parsed = [isbn.strip() for isbn in isbn_list.split(",") if isbn.strip()]
+            isbn_list_parsed = tuple(isbn for isbn in map(str.strip, isbn_list.split(",")) if isbn) or None
         
-        # Calculer page et page_size depuis offset/limit
-        page_size = limit
-        page = (offset // page_size) + 1
+        sort_by = sort if sort else None
         
-        # Récupérer analyses filtrées
-        result = repo.list_filtered(
-            batch_id=batch_id,
-            filters=filters if filters else None,
-            isbn_list=isbn_list_parsed,
-            sort_by=sort if sort else None,
-            sort_desc=sort_desc,
-            page=page,
-            page_size=page_size
-        )
+        if cursor is not None:
+            # Pagination keyset : coût constant quelle que soit la profondeur
+            after = _decode_cursor(cursor, sort_by, sort_desc)
+            result = await db.run_sync(lambda session: AnalysisRepository(session).list_filtered(
+                batch_id=batch_id,
+                filters=filters if filters else None,
+                isbn_list=isbn_list_parsed,
+                sort_by=sort_by,
+                sort_desc=sort_desc,
+                page_size=limit,
+                after=after
+            ))
+        else:
+            # Calculer page et page_size depuis offset/limit
+            page_size = limit
+            page = (offset // page_size) + 1
+            
+            if limit > _STREAM_THRESHOLD:
+                # Grandes pages : count + SELECT préparés, rows streamées
+                total, stmt = await db.run_sync(lambda session: AnalysisRepository(session).page_statement(
+                    batch_id=batch_id,
+                    filters=filters if filters else None,
+                    isbn_list=isbn_list_parsed,
+                    sort_by=sort_by,
+                    sort_desc=sort_desc,
+                    page=page,
+                    page_size=page_size
+                ))
+                pages = (total + page_size - 1) // page_size
+                meta = {
+                    "page": page,
+                    "page_size": page_size,
+                    "total": total,
+                    "pages": pages,
+                    "has_next": page < pages,
+                    "has_prev": page > 1
+                }
+                return StreamingResponse(
+                    _stream_page(db.bind, stmt, meta, sort_by, sort_desc),
+                    media_type="application/json"
+                )
+            
+            # Récupérer analyses filtrées
+            result = await db.run_sync(lambda session: AnalysisRepository(session).list_filtered(
+                batch_id=batch_id,
+                filters=filters if filters else None,
+                isbn_list=isbn_list_parsed,
+                sort_by=sort_by,
+                sort_desc=sort_desc,
+                page=page,
+                page_size=page_size
+            ))
         
         # Convertir Page[Analysis] vers PageOut[AnalysisOut]
         return PageOut(
-            items=[AnalysisOut.from_orm(item) for item in result.items],
+            items=_ANALYSIS_LIST.validate_python(result.items, from_attributes=True),
             page=result.page,
             page_size=result.page_size,
             total=result.total,
             pages=result.pages,
             has_next=result.has_next,
-            has_prev=result.has_prev
+            has_prev=result.has_prev,
+            next_cursor=_encode_cursor(result.next_after, sort_by, sort_desc) if result.next_after else None
         )
         
     except Exception as e:
@@ -174,7 +333,8 @@ async def get_top_analyses(
     n: int = Query(10, ge=1, le=100, description="Number of top items"),
     strategy: str = Query("balanced", regex="^(roi|velocity|profit|balanced)$", 
                          description="Strategy: roi|velocity|profit|balanced"),
-    db: Session = Depends(get_sync_db_dependency)
+    db: AsyncSession = Depends(get_async_db_dependency),
+    cache: ResponseCache = Depends(get_cache)
 ):
     """Top N analyses par stratégie
     
@@ -185,21 +345,26 @@ async def get_top_analyses(
     - balanced: Score pondéré (60% ROI + 40% velocity)
     """
     try:
-        # Vérifier que le batch existe
-        batch = db.query(Batch).filter(Batch.id == batch_id).first()
-        if not batch:
-            raise NotFoundError("Batch", batch_id)
+        # Top-N stable entre deux écritures : cache invalidé à chaque insertion
+        cached = await cache.get(topn_key(batch_id, strategy, n))
+        if cached is not None:
+            return cached
         
-        repo = AnalysisRepository(db)
+        # Vérifier que le batch existe
+        await db.run_sync(lambda session: AnalysisRepository(session).assert_batch_exists(batch_id))
         
         # Récupérer top analyses
-        top_analyses = repo.top_n_for_batch(
+        top_analyses = await db.run_sync(lambda session: AnalysisRepository(session).top_n_for_batch(
             batch_id=batch_id,
             strategy=strategy,
             limit=n
-        )
+        ))
         
-        return [AnalysisOut.from_orm(analysis) for analysis in top_analyses]
+        top = _ANALYSIS_LIST.validate_python(top_analyses, from_attributes=True)
+        await cache.set(
+            topn_key(batch_id, strategy, n), top, settings.cache.topn_cache_ttl, index=topn_index(batch_id)
+        )
+        return top
         
     except Exception as e:
         raise map_exception_to_http(e)
@@ -1,21 +1,56 @@
 from typing import List
 from fastapi import APIRouter, Depends, HTTPException, Path, status
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import case, func, or_, select, update
 from datetime import datetime
 
-from ..deps.database import get_sync_db_dependency
+from ..deps.database import get_async_db_dependency
+from ..deps.cache import ResponseCache, get_cache, STATS_KEY, batch_key
 from ..schemas.batch import BatchOut, BatchStatusUpdateIn
 from ....models.batch import Batch, BatchStatus
 from ....models.analysis import Analysis
 from ....core.exceptions import map_exception_to_http, NotFoundError
+from ....config.settings import settings
 
 router = APIRouter()
 
+# Transitions de statut autorisées (ancien → nouveaux)
+VALID_TRANSITIONS = {
+    BatchStatus.PENDING: [BatchStatus.RUNNING, BatchStatus.FAILED],
+    BatchStatus.RUNNING: [BatchStatus.DONE, BatchStatus.FAILED],
+    BatchStatus.DONE: [],  # Terminal state
+    BatchStatus.FAILED: [BatchStatus.PENDING]  # Peut redémarrer
+}
+
+
+def _items_total_backfill():
+    """items_total = COUNT(analyses) si le batch ne l'a pas renseigné (sous-requête corrélée)"""
+    analysis_count = (
+        select(func.count(Analysis.id))
+        .where(Analysis.batch_id == Batch.id)
+        .scalar_subquery()
+    )
+    return case((Batch.items_total == 0, analysis_count), else_=Batch.items_total)
+
+
+# Colonnes de la vue liste : strategy_snapshot (JSON potentiellement
+# volumineux) n'est renvoyé que par GET /batches/{id} ; items_total retombe
+# sur le nombre d'analyses tant que le batch n'est pas finalisé (lecture seule)
+_BATCH_SUMMARY_COLUMNS = (
+    Batch.id,
+    Batch.name,
+    Batch.status,
+    _items_total_backfill().label("items_total"),
+    Batch.items_processed,
+    Batch.created_at,
+    Batch.started_at,
+    Batch.finished_at,
+)
+
 
 @router.get("/", response_model=List[BatchOut])
 async def list_batches(
-    db: Session = Depends(get_sync_db_dependency)
+    db: AsyncSession = Depends(get_async_db_dependency)
 ):
     """Liste des batches avec status + progress_metrics
     
@@ -26,24 +61,16 @@ async def list_batches(
     - Timestamps de création/démarrage/fin
     """
     try:
-        # Récupérer batches avec comptage d'analyses
-        batches_query = db.query(
-            Batch,
-            func.coalesce(func.count(Analysis.id), 0).label('analysis_count')
-        ).outerjoin(Analysis).group_by(Batch.id).order_by(Batch.created_at.desc())
-        
-        batches_data = batches_query.all()
+        # Lecture seule : items_total calculé dans le SELECT, persisté à la finalisation
+        rows = (await db.execute(
+            select(*_BATCH_SUMMARY_COLUMNS).order_by(Batch.created_at.desc())
+        )).all()
         
-        result = []
-        for batch, analysis_count in batches_data:
-            # Mettre à jour items_total si pas défini
-            if batch.items_total == 0 and analysis_count > 0:
-                batch.items_total = analysis_count
-                
-            batch_out = BatchOut.from_orm(batch)
-            result.append(batch_out)
-        
-        return result
+        # Lignes issues de la DB : construction sans re-validation
+        return [
+            BatchOut.model_construct(**{**row._mapping, "status": row.status.value})
+            for row in rows
+        ]
         
     except Exception as e:
         raise map_exception_to_http(e)
@@ -51,7 +78,8 @@ async def list_batches(
 
 @router.get("/stats", response_model=dict)
 async def get_batches_stats(
-    db: Session = Depends(get_sync_db_dependency)
+    db: AsyncSession = Depends(get_async_db_dependency),
+    cache: ResponseCache = Depends(get_cache)
 ):
     """Statistiques globales des batches
     
@@ -62,38 +90,41 @@ async def get_batches_stats(
     - Métriques de performance globales
     """
     try:
-        # Compter batches par statut
-        status_counts = db.query(
-            Batch.status,
-            func.count(Batch.id).label('count')
-        ).group_by(Batch.status).all()
-        
-        status_dict = {status.value: 0 for status in BatchStatus}
-        for status, count in status_counts:
-            status_dict[status.value] = count
-        
-        # Compter analyses totales
-        total_analyses = db.query(func.count(Analysis.id)).scalar() or 0
-        
-        # Batches en cours
-        running_batches = db.query(func.count(Batch.id)).filter(
-            Batch.status == BatchStatus.RUNNING
-        ).scalar() or 0
-        
-        # Batch le plus récent
-        latest_batch = db.query(Batch).order_by(
+        cached = await cache.get(STATS_KEY)
+        if cached is not None:
+            return cached
+        
+        # Un seul aller-retour : agrégats FILTER par statut + sous-requêtes scalaires
+        latest_batch = select(Batch.id, Batch.created_at).order_by(
             Batch.created_at.desc()
-        ).first()
+        ).limit(1).subquery()
+        
+        stats_query = select(
+            *[
+                func.count(Batch.id).filter(Batch.status == batch_status).label(batch_status.value)
+                for batch_status in BatchStatus
+            ],
+            select(func.count(Analysis.id)).scalar_subquery().label("total_analyses"),
+            select(latest_batch.c.id).scalar_subquery().label("latest_batch_id"),
+            select(latest_batch.c.created_at).scalar_subquery().label("latest_batch_created"),
+        ).select_from(Batch)
+        
+        row = (await db.execute(stats_query)).one()._mapping
+        
+        status_dict = {batch_status.value: row[batch_status.value] for batch_status in BatchStatus}
         
-        return {
+        stats = {
             "batches_by_status": status_dict,
             "total_batches": sum(status_dict.values()),
-            "total_analyses": total_analyses,
-            "running_batches": running_batches,
-            "latest_batch_id": latest_batch.id if latest_batch else None,
-            "latest_batch_created": latest_batch.created_at if latest_batch else None
+            "total_analyses": row["total_analyses"] or 0,
+            "running_batches": status_dict[BatchStatus.RUNNING.value],
+            "latest_batch_id": row["latest_batch_id"],
+            "latest_batch_created": row["latest_batch_created"]
         }
         
+        await cache.set(STATS_KEY, stats, settings.cache.stats_cache_ttl)
+        return stats
+        
     except Exception as e:
         raise map_exception_to_http(e)
 
@@ -102,7 +133,8 @@ async def get_batches_stats(
 async def update_batch_status(
     batch_id: int = Path(..., description="Batch ID"),
     status_update: BatchStatusUpdateIn = ...,
-    db: Session = Depends(get_sync_db_dependency)
+    db: AsyncSession = Depends(get_async_db_dependency),
+    cache: ResponseCache = Depends(get_cache)
 ):
     """Mise à jour du statut de batch avec validation
     
@@ -113,92 +145,127 @@ async def update_batch_status(
     - Validation de cohérence des données
     """
     try:
-        # Récupérer le batch
-        batch = db.query(Batch).filter(Batch.id == batch_id).first()
-        if not batch:
-            raise NotFoundError("Batch", batch_id)
-        
-        # Validation des transitions de statut
-        old_status = batch.status
-        new_status = status_update.status
-        
-        # Validation business logic pour transitions
-        valid_transitions = {
-            BatchStatus.PENDING: [BatchStatus.RUNNING, BatchStatus.FAILED],
-            BatchStatus.RUNNING: [BatchStatus.DONE, BatchStatus.FAILED],
-            BatchStatus.DONE: [],  # Terminal state
-            BatchStatus.FAILED: [BatchStatus.PENDING]  # Peut redémarrer
-        }
+        new_status = BatchStatus(status_update.status.value)
+        allowed_from = [old for old, targets in VALID_TRANSITIONS.items() if new_status in targets]
         
-        if new_status not in valid_transitions.get(old_status, []):
-            raise HTTPException(
-                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-                detail={
-                    "error": "invalid_status_transition",
-                    "message": f"Cannot transition from {old_status.value} to {new_status.value}",
-                    "current_status": old_status.value,
-                    "requested_status": new_status.value
-                }
-            )
-        
-        # Mettre à jour le statut
-        batch.status = new_status
-        
-        # Mettre à jour les timestamps selon le nouveau statut
+        # Timestamps selon le nouveau statut (chaque cible n'a qu'une origine possible)
         now = datetime.utcnow()
+        values = {"status": new_status}
+        # items_total tel qu'il sera après l'UPDATE (borne de items_processed)
+        items_total = Batch.items_total
         
-        if new_status == BatchStatus.RUNNING and old_status == BatchStatus.PENDING:
-            batch.started_at = now
+        if new_status == BatchStatus.RUNNING:
+            values["started_at"] = now
+            
+        elif new_status == BatchStatus.DONE:
+            values["finished_at"] = now
+            # Finalisation : items_total depuis le nombre d'analyses si absent
+            # (pas sur FAILED : un batch redémarré garderait un total périmé)
+            items_total = _items_total_backfill()
+            values["items_total"] = items_total
             
-        elif new_status in [BatchStatus.DONE, BatchStatus.FAILED]:
-            batch.finished_at = now
+        elif new_status == BatchStatus.FAILED:
+            values["finished_at"] = now
             
-        elif new_status == BatchStatus.PENDING and old_status == BatchStatus.FAILED:
+        elif new_status == BatchStatus.PENDING:
             # Reset pour redémarrage
-            batch.started_at = None
-            batch.finished_at = None
+            values["started_at"] = None
+            values["finished_at"] = None
+        
+        # ✅ Transition validée par SQL : UPDATE conditionnel sur l'ancien statut
+        # (atomique face aux PATCH concurrents, un seul aller-retour)
+        conditions = [Batch.id == batch_id, Batch.status.in_(allowed_from)]
         
-        # Mettre à jour le compteur si fourni
         if status_update.items_processed is not None:
             # Validation que items_processed <= items_total
-            if batch.items_total > 0 and status_update.items_processed > batch.items_total:
+            conditions.append(
+                or_(items_total == 0, items_total >= status_update.items_processed)
+            )
+            values["items_processed"] = status_update.items_processed
+        
+        batch = await db.scalar(
+            update(Batch)
+            .where(*conditions)
+            .values(**values)
+            .returning(Batch)
+            .execution_options(synchronize_session=False, populate_existing=True)
+        )
+        
+        if batch is None:
+            # Aucune ligne mise à jour : diagnostic (chemin d'erreur uniquement)
+            row = (await db.execute(
+                select(Batch, items_total.label("items_total")).where(Batch.id == batch_id)
+            )).first()
+            if row is None:
+                raise NotFoundError("Batch", batch_id)
+            current, current_total = row
+            
+            if current.status not in allowed_from:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail={
+                        "error": "invalid_status_transition",
+                        "message": f"Cannot transition from {current.status.value} to {new_status.value}",
+                        "current_status": current.status.value,
+                        "requested_status": new_status.value
+                    }
+                )
+            
+            if (status_update.items_processed is not None
+                    and current_total > 0
+                    and status_update.items_processed > current_total):
                 raise HTTPException(
                     status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
                     detail={
                         "error": "invalid_items_processed",
-                        "message": f"items_processed ({status_update.items_processed}) cannot exceed items_total ({batch.items_total})"
+                        "message": f"items_processed ({status_update.items_processed}) cannot exceed items_total ({current_total})"
                     }
                 )
             
-            batch.items_processed = status_update.items_processed
+            # Le statut a changé entre-temps (PATCH concurrent)
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail={
+                    "error": "concurrent_status_update",
+                    "message": f"Batch {batch_id} was modified concurrently, retry with fresh state"
+                }
+            )
         
-        db.commit()
+        await db.commit()
+        await cache.delete(batch_key(batch_id), STATS_KEY)
         
         return BatchOut.from_orm(batch)
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise map_exception_to_http(e)
 
 
 @router.get("/{batch_id}", response_model=BatchOut)
 async def get_batch(
     batch_id: int = Path(..., description="Batch ID"),
-    db: Session = Depends(get_sync_db_dependency)
+    db: AsyncSession = Depends(get_async_db_dependency),
+    cache: ResponseCache = Depends(get_cache)
 ):
     """Récupération d'un batch spécifique
     
     Récupère les détails d'un batch avec ses métriques de progression.
     """
     try:
-        batch = db.query(Batch).filter(Batch.id == batch_id).first()
+        cached = await cache.get(batch_key(batch_id))
+        if cached is not None:
+            return cached
+        
+        batch = await db.scalar(select(Batch).where(Batch.id == batch_id))
         if not batch:
             raise NotFoundError("Batch", batch_id)
         
-        return BatchOut.from_orm(batch)
+        batch_out = BatchOut.from_orm(batch)
+        await cache.set(batch_key(batch_id), batch_out, settings.cache.batch_cache_ttl)
+        return batch_out
         
     except Exception as e:
         raise map_exception_to_http(e)
@@ -1,13 +1,47 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from typing import Optional
+from fastapi import APIRouter
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from sqlalchemy import text
+from sqlalchemy.pool import NullPool, QueuePool
 import time
 
-from ..deps.database import get_sync_db_dependency
+from ....core import database
 from ....config.settings import settings
 
 router = APIRouter()
 
+# Résultat du dernier probe DB (réutilisé pendant _PROBE_TTL secondes)
+_PROBE_TTL = 1.0
+_last_check_ts = 0.0
+_last_check_result: Optional[dict] = None
+_probe_engine: Optional[AsyncEngine] = None
+
+
+def _get_probe_engine() -> AsyncEngine:
+    """Engine séparé (1 connexion max) pour les sondes de santé, même URL que l'engine async"""
+    global _probe_engine
+    if _probe_engine is None:
+        bind = database.async_engine
+        if bind.url.get_backend_name() == "sqlite":
+            kwargs = {"poolclass": NullPool}  # Explicite aussi pour les URL mode=memory
+        elif settings.database.use_pgbouncer:
+            kwargs = {
+                "poolclass": NullPool,
+                "connect_args": {"statement_cache_size": 0, "prepared_statement_cache_size": 0},
+            }
+        else:
+            kwargs = {"pool_size": 1, "max_overflow": 0, "pool_pre_ping": True}
+        _probe_engine = create_async_engine(bind.url, **kwargs)
+    return _probe_engine
+
+
+async def dispose_probe_engine() -> None:
+    """Ferme la connexion de sonde (shutdown du lifespan)"""
+    global _probe_engine
+    if _probe_engine is not None:
+        await _probe_engine.dispose()
+        _probe_engine = None
+
 
 @router.get("/")
 async def health_check():
@@ -21,36 +55,67 @@ async def health_check():
 
 
 @router.get("/db")
-async def database_health_check(db: Session = Depends(get_sync_db_dependency)):
-    """Database connectivity health check"""
+async def database_health_check():
+    """Database connectivity health check
+    
+    Le vrai SELECT 1 tourne au plus une fois par seconde, sur un mini-engine
+    dédié : les sondes ne prennent jamais un slot du pool des requêtes.
+    """
+    global _last_check_ts, _last_check_result
+    
+    if _last_check_result is not None and time.monotonic() - _last_check_ts < _PROBE_TTL:
+        return {**_last_check_result, "timestamp": time.time()}
+    
     try:
         start_time = time.time()
         
         # Simple database query
-        result = db.execute(text("SELECT 1")).scalar()
+        async with _get_probe_engine().connect() as conn:
+            result = await conn.scalar(text("SELECT 1"))
         
         end_time = time.time()
         response_time = round((end_time - start_time) * 1000, 2)  # ms
         
         if result == 1:
-            return {
+            check = {
                 "status": "healthy",
                 "database": "connected",
-                "response_time_ms": response_time,
-                "timestamp": time.time()
+                "response_time_ms": response_time
             }
         else:
-            return {
+            check = {
                 "status": "unhealthy",
                 "database": "query_failed",
-                "response_time_ms": response_time,
-                "timestamp": time.time()
+                "response_time_ms": response_time
             }
             
     except Exception as e:
-        return {
+        check = {
             "status": "unhealthy",
             "database": "connection_failed",
-            "error": str(e),
-            "timestamp": time.time()
+            "error": str(e)
         }
+    
+    _last_check_ts, _last_check_result = time.monotonic(), check
+    return {**check, "timestamp": time.time()}
+
+
+@router.get("/db/pool")
+async def database_pool_status():
+    """Connection pool metrics for the async engine (operator tuning)"""
+    pool = database.async_engine.pool
+    metrics = {
+        "pool_class": type(pool).__name__,
+        "status": pool.status(),
+        "timestamp": time.time()
+    }
+    
+    if isinstance(pool, QueuePool):
+        metrics.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow()
+        })
+    
+    return metrics
@@ -44,6 +44,12 @@ class AnalysisCreateIn(BaseModel):
     raw_keepa: Optional[str] = Field(None, description="Raw Keepa API response")
 
 
+class AnalysisBulkOut(BaseModel):
+    """Bulk creation result (duplicates are skipped, not errors)"""
+    inserted: int = Field(..., description="Number of analyses inserted")
+    skipped: int = Field(..., description="Number of duplicate (batch_id, ISBN/ASIN) items skipped")
+
+
 class AnalysisFilters(BaseModel):
     """Analysis filtering parameters"""
     batch_id: int = Field(..., description="Batch ID (required)")
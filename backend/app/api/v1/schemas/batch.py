@@ -1,6 +1,6 @@
 from typing import Optional
 from datetime import datetime
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, computed_field
 from enum import Enum
 
 
@@ -24,23 +24,22 @@ class BatchOut(BaseModel):
     started_at: Optional[datetime] = Field(None, description="Processing start timestamp")
     finished_at: Optional[datetime] = Field(None, description="Processing finish timestamp")
     
-    # Computed progress metrics
-    progress_percent: Optional[float] = Field(None, description="Processing progress percentage")
-    items_remaining: int = Field(..., description="Items remaining to process")
-    
     class Config:
         from_attributes = True
         use_enum_values = True
-        
-    def __init__(self, **data):
-        super().__init__(**data)
-        # Calculate progress metrics
+    
+    # Computed progress metrics
+    @computed_field(description="Processing progress percentage")
+    @property
+    def progress_percent(self) -> float:
         if self.items_total > 0:
-            self.progress_percent = round((self.items_processed / self.items_total) * 100, 1)
-        else:
-            self.progress_percent = 0.0
-        
-        self.items_remaining = max(0, self.items_total - self.items_processed)
+            return round((self.items_processed / self.items_total) * 100, 1)
+        return 0.0
+    
+    @computed_field(description="Items remaining to process")
+    @property
+    def items_remaining(self) -> int:
+        return max(0, self.items_total - self.items_processed)
 
 
 class BatchStatusUpdateIn(BaseModel):
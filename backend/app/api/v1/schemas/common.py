@@ -1,4 +1,4 @@
-from typing import Generic, TypeVar, List
+from typing import Generic, TypeVar, List, Optional
 from pydantic import BaseModel, Field
 
 T = TypeVar('T')
@@ -7,12 +7,13 @@ T = TypeVar('T')
 class PageOut(BaseModel, Generic[T]):
     """Generic pagination response schema"""
     items: List[T] = Field(..., description="List of items for current page")
-    page: int = Field(..., description="Current page number (1-based)")
+    page: Optional[int] = Field(..., description="Current page number (1-based, null in cursor mode)")
     page_size: int = Field(..., description="Number of items per page")
-    total: int = Field(..., description="Total number of items")
-    pages: int = Field(..., description="Total number of pages")
+    total: Optional[int] = Field(..., description="Total number of items (null in cursor mode)")
+    pages: Optional[int] = Field(..., description="Total number of pages (null in cursor mode)")
     has_next: bool = Field(..., description="Whether there is a next page")
     has_prev: bool = Field(..., description="Whether there is a previous page")
+    next_cursor: Optional[str] = Field(None, description="Opaque cursor for the next page (keyset pagination)")
     
     class Config:
         from_attributes = True
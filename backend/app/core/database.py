@@ -1,15 +1,69 @@
+import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.ext.declarative import declarative_base
-from typing import Generator
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from typing import AsyncGenerator
 from ..config.settings import settings
+from ..models import Base  # Shared Base: importing the package registers every table
 
-# Create engine with settings
+
+def _async_database_url(url: str) -> str:
+    """Map a sync database URL onto its asyncio driver (asyncpg / aiosqlite)"""
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    return url
+
+
+def _recommended_pool_size() -> int:
+    """HikariCP sizing formula: (cpu_count * 2) + effective_spindle_count"""
+    return (os.cpu_count() or 1) * 2 + 1
+
+
+def _pool_kwargs(url: str) -> dict:
+    """QueuePool sizing (SQLite uses a file/singleton pool without these args)
+
+    The configured pool_size acts as a ceiling; the effective size follows the
+    core-count formula so extra workers don't thrash the database.
+    """
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": min(settings.database.pool_size, _recommended_pool_size()),
+        "max_overflow": settings.database.max_overflow,
+        "pool_pre_ping": True,
+        "pool_recycle": 1800,
+    }
+
+
+def _async_engine_kwargs(url: str) -> dict:
+    """Async engine options; behind PgBouncer (transaction mode) pooling is delegated"""
+    if settings.database.use_pgbouncer:
+        # PgBouncer multiplexes transactions over backend sessions, so asyncpg
+        # prepared statements must not be cached per connection.
+        return {
+            "poolclass": NullPool,
+            "connect_args": {"statement_cache_size": 0, "prepared_statement_cache_size": 0},
+        }
+    return _pool_kwargs(url)
+
+
+# Create engine with settings (scripts, create_tables, sync repositories)
 engine = create_engine(
     settings.database_url,
     echo=settings.database.echo_sql,
-    pool_size=settings.database.pool_size,
-    max_overflow=settings.database.max_overflow,
+    query_cache_size=settings.database.query_cache_size,
+    **({"poolclass": NullPool} if settings.database.use_pgbouncer else _pool_kwargs(settings.database_url)),
+)
+
+# Native async engine used by the API request path
+async_engine = create_async_engine(
+    _async_database_url(settings.database_url),
+    echo=settings.database.echo_sql,
+    query_cache_size=settings.database.query_cache_size,
+    **_async_engine_kwargs(settings.database_url),
 )
 
 # Session factory
@@ -20,17 +74,19 @@ SessionLocal = sessionmaker(
     bind=engine
 )
 
-# Base for models
-Base = declarative_base()
+# Async session factory
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
 
 # Dependency for FastAPI
-def get_db() -> Generator[Session, None, None]:
-    """Database session dependency for FastAPI"""
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    """Async database session dependency for FastAPI"""
+    async with AsyncSessionLocal() as session:
+        yield session
 
 # Utility functions for testing and setup
 def create_tables():
@@ -1,5 +1,13 @@
 from fastapi import HTTPException, status
-from typing import Dict, Type
+from functools import lru_cache
+import logging
+from typing import Callable, Dict, Type
+
+import orjson
+
+from ..repositories.base import InvalidSortFieldError, DuplicateIsbnInBatchError
+
+logger = logging.getLogger(__name__)
 
 
 class ArbitrageVaultException(Exception):
@@ -15,6 +23,11 @@ class NotFoundError(ArbitrageVaultException):
         super().__init__(f"{resource} with identifier '{identifier}' not found")
 
 
+class InvalidCursorError(ArbitrageVaultException):
+    """Pagination cursor could not be decoded"""
+    pass
+
+
 # HTTP exception mapping
 EXCEPTION_MAP: Dict[Type[Exception], int] = {
     # Repository exceptions → HTTP status codes
@@ -22,6 +35,99 @@ EXCEPTION_MAP: Dict[Type[Exception], int] = {
 }
 
 
+# Squelette constant des réponses 500 (seul "type" varie)
+_INTERNAL_ERROR_DETAIL = {
+    "error": "internal_server_error",
+    "message": "An internal error occurred",
+}
+
+
+@lru_cache(maxsize=256)
+def internal_error_body(type_name: str) -> bytes:
+    """JSON body of a 500 response, serialized once per exception class"""
+    return orjson.dumps({**_INTERNAL_ERROR_DETAIL, "type": type_name})
+
+
+def _handle_invalid_sort(exc: Exception) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        detail={
+            "error": "invalid_sort_field",
+            "message": str(exc),
+            "type": "InvalidSortFieldError"
+        }
+    )
+
+
+def _handle_duplicate(exc: Exception) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail={
+            "error": "duplicate_isbn",
+            "message": str(exc),
+            "type": "DuplicateIsbnInBatchError"
+        }
+    )
+
+
+def _handle_not_found(exc: NotFoundError) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail={
+            "error": "not_found",
+            "message": str(exc),
+            "resource": exc.resource,
+            "identifier": str(exc.identifier),
+            "type": "NotFoundError"
+        }
+    )
+
+
+def _handle_invalid_cursor(exc: Exception) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        detail={
+            "error": "invalid_cursor",
+            "message": str(exc),
+            "type": "InvalidCursorError"
+        }
+    )
+
+
+def _handle_unexpected(exc: Exception) -> HTTPException:
+    # Le reste → 500 loggé (traceback seulement en DEBUG : formatage coûteux)
+    logger.error(
+        "Unhandled exception: %s: %s", type(exc).__name__, exc,
+        exc_info=exc if logger.isEnabledFor(logging.DEBUG) else False
+    )
+    
+    return HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail={**_INTERNAL_ERROR_DETAIL, "type": type(exc).__name__}
+    )
+
+
+# Dispatch classe d'exception → handler (construit à l'import)
+_HANDLERS: Dict[Type[Exception], Callable[[Exception], HTTPException]] = {
+    InvalidSortFieldError: _handle_invalid_sort,
+    DuplicateIsbnInBatchError: _handle_duplicate,
+    NotFoundError: _handle_not_found,
+    InvalidCursorError: _handle_invalid_cursor,
+}
+
+
+@lru_cache(maxsize=256)
+def _resolve_handler(exc_type: Type[Exception]) -> Callable[[Exception], HTTPException]:
+    """Handler de la classe déclarée la plus proche dans la MRO, sinon _handle_unexpected
+    
+    Cache borné séparé : _HANDLERS reste la table déclarée, jamais modifiée.
+    """
+    return next(
+        (_HANDLERS[cls] for cls in exc_type.__mro__ if cls in _HANDLERS),
+        _handle_unexpected
+    )
+
+
 def map_exception_to_http(exc: Exception) -> HTTPException:
     """Map custom exceptions to HTTP exceptions
     
@@ -29,53 +135,9 @@ def map_exception_to_http(exc: Exception) -> HTTPException:
     - InvalidSortFieldError → 422
     - DuplicateIsbnInBatchError → 409  
     - NotFoundError → 404
+    - InvalidCursorError → 422
     - Le reste → 500 loggé
-    """
-    from ..repositories.base import InvalidSortFieldError, DuplicateIsbnInBatchError
     
-    if isinstance(exc, InvalidSortFieldError):
-        return HTTPException(
-            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-            detail={
-                "error": "invalid_sort_field",
-                "message": str(exc),
-                "type": "InvalidSortFieldError"
-            }
-        )
-    
-    elif isinstance(exc, DuplicateIsbnInBatchError):
-        return HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail={
-                "error": "duplicate_isbn",
-                "message": str(exc),
-                "type": "DuplicateIsbnInBatchError"
-            }
-        )
-    
-    elif isinstance(exc, NotFoundError):
-        return HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail={
-                "error": "not_found",
-                "message": str(exc),
-                "resource": exc.resource,
-                "identifier": str(exc.identifier),
-                "type": "NotFoundError"
-            }
-        )
-    
-    else:
-        # Le reste → 500 loggé
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.error(f"Unhandled exception: {type(exc).__name__}: {exc}", exc_info=True)
-        
-        return HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail={
-                "error": "internal_server_error",
-                "message": "An internal error occurred",
-                "type": type(exc).__name__
-            }
-        )
+    Handler résolu sur la MRO de type(exc), mémorisé par classe.
+    """
+    return _resolve_handler(type(exc))(exc)
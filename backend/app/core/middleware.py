@@ -1,81 +1,90 @@
-from fastapi import Request, HTTPException
-from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi import HTTPException
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 import logging
 import time
-import traceback
 
-from .exceptions import map_exception_to_http
+import orjson
+
+from ..config.settings import settings
+from .exceptions import internal_error_body, map_exception_to_http
+from .responses import orjson_default
 
 logger = logging.getLogger(__name__)
 
+_JSON_CONTENT_TYPE = (b"content-type", b"application/json")
+
 
-class ErrorHandlingMiddleware(BaseHTTPMiddleware):
-    """Middleware pour gestion globale des erreurs"""
+class ObservabilityMiddleware:
+    """Middleware unique : gestion globale des erreurs + timing/logging des requêtes
+    
+    ASGI pur (pas de BaseHTTPMiddleware) : ni Request/Response ni tâche anyio
+    supplémentaire par requête. Une seule couche, un seul send_wrapper et un
+    seul try/except au lieu d'empiler ErrorHandling + RequestLogging.
     
-    async def dispatch(self, request: Request, call_next):
+    log_requests (par défaut settings.app.debug) active le log détaillé
+    entrée/sortie ; sinon une seule ligne de timing par requête.
+    """
+    
+    def __init__(self, app: ASGIApp, log_requests: bool = settings.app.debug):
+        self.app = app
+        self.log_requests = log_requests
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        start_ns = time.perf_counter_ns()
+        status_code = None
+        
+        # Log incoming request (query string décodée seulement si INFO est actif)
+        if self.log_requests and logger.isEnabledFor(logging.INFO):
+            logger.info("→ %s %s %s", scope["method"], scope["path"], scope.get("query_string", b"").decode())
+        
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
         try:
-            start_time = time.time()
-            
-            response = await call_next(request)
-            
-            # Log request timing
-            process_time = time.time() - start_time
-            logger.info(
-                f"{request.method} {request.url.path} - "
-                f"{response.status_code} - {process_time:.3f}s"
-            )
-            
-            return response
+            await self.app(scope, receive, send_wrapper)
             
         except HTTPException:
             # FastAPI HTTPExceptions, let them pass through
             raise
             
         except Exception as exc:
-            # Map custom exceptions to HTTP
+            # Map custom exceptions to HTTP (les 500 y sont loggées, une seule fois)
             http_exc = map_exception_to_http(exc)
             
-            # Log the original exception for debugging
-            logger.error(
-                f"Unhandled exception in {request.method} {request.url.path}: "
-                f"{type(exc).__name__}: {exc}",
-                exc_info=True
-            )
+            if self.log_requests and logger.isEnabledFor(logging.INFO):
+                # Timing seulement : l'erreur elle-même est loggée par le mapper
+                logger.info(
+                    "✗ %s %s %s (%.3fms)", http_exc.status_code, scope["method"], scope["path"],
+                    (time.perf_counter_ns() - start_ns) / 1_000_000
+                )
             
-            # Return structured error response
-            return JSONResponse(
-                status_code=http_exc.status_code,
-                content=http_exc.detail
-            )
-
-
-class RequestLoggingMiddleware(BaseHTTPMiddleware):
-    """Middleware pour logging des requêtes"""
-    
-    async def dispatch(self, request: Request, call_next):
-        start_time = time.time()
-        
-        # Log incoming request
-        logger.info(f"→ {request.method} {request.url.path} {dict(request.query_params)}")
-        
-        try:
-            response = await call_next(request)
+            if status_code is not None:
+                # Réponse déjà commencée : impossible d'envoyer l'erreur
+                raise
             
-            # Log successful response
-            process_time = time.time() - start_time
-            logger.info(
-                f"← {response.status_code} {request.method} {request.url.path} "
-                f"({process_time:.3f}s)"
-            )
-            
-            return response
-            
-        except Exception as exc:
-            # Log failed request
-            process_time = time.time() - start_time
-            logger.error(
-                f"✗ {request.method} {request.url.path} failed after {process_time:.3f}s: "
-                f"{type(exc).__name__}: {exc}"
-            )
-            raise
+            # Return structured error response (500 : corps pré-sérialisé)
+            if http_exc.status_code == 500:
+                body = internal_error_body(http_exc.detail["type"])
+            else:
+                body = orjson.dumps(http_exc.detail, default=orjson_default)
+            await send({
+                "type": "http.response.start",
+                "status": http_exc.status_code,
+                "headers": [_JSON_CONTENT_TYPE, (b"content-length", str(len(body)).encode())],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        
+        # Log request timing (formatage seulement si INFO est actif)
+        if logger.isEnabledFor(logging.INFO):
+            elapsed_ms = (time.perf_counter_ns() - start_ns) / 1_000_000
+            if self.log_requests:
+                logger.info("← %s %s %s (%.3fms)", status_code, scope["method"], scope["path"], elapsed_ms)
+            else:
+                logger.info("%s %s - %s - %.3fms", scope["method"], scope["path"], status_code, elapsed_ms)
@@ -0,0 +1,23 @@
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import ORJSONResponse
+
+
+def orjson_default(obj: Any) -> Any:
+    """Fallback encoder for types orjson does not serialize natively"""
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class AppJSONResponse(ORJSONResponse):
+    """Default API response class: orjson (C serializer) with Decimal support"""
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            default=orjson_default,
+            option=orjson.OPT_SERIALIZE_NUMPY,
+        )
@@ -2,16 +2,28 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import logging
+import logging.handlers
+import queue
 
-from .api.v1.routers import analyses, batches, health
 from .core.database import create_tables
-from .core.middleware import ErrorHandlingMiddleware, RequestLoggingMiddleware
+from .core.middleware import ObservabilityMiddleware
+from .core.responses import AppJSONResponse
 from .config.settings import settings
 
-# Configure logging
+# Configure logging : le chemin requête ne fait qu'un enqueue, le formatage
+# et l'écriture sur stderr se font dans le thread du QueueListener
+# (démarré/arrêté par le lifespan)
+_log_queue = queue.SimpleQueue()
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(
+    logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+)
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    handlers=[logging.handlers.QueueHandler(_log_queue)]
+)
+log_listener = logging.handlers.QueueListener(
+    _log_queue, _log_stream_handler, respect_handler_level=True
 )
 logger = logging.getLogger(__name__)
 
@@ -20,6 +32,7 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     """Application lifespan events"""
     # Startup
+    log_listener.start()
     logger.info("🚀 ArbitrageVault BookFinder API starting...")
     logger.info(f"📊 Version: {settings.app.version}")
     logger.info(f"🔧 Debug mode: {settings.app.debug}")
@@ -32,6 +45,9 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("🛑 ArbitrageVault BookFinder API shutting down...")
+    from .api.v1.routers.health import dispose_probe_engine
+    await dispose_probe_engine()  # Connexion de la sonde /health/db
+    log_listener.stop()  # Flush des logs en attente
 
 
 def create_app() -> FastAPI:
@@ -42,32 +58,36 @@ def create_app() -> FastAPI:
         version=settings.app.version,
         description="Tool for identifying profitable book arbitrage opportunities using Keepa API data analysis",
         lifespan=lifespan,
+        default_response_class=AppJSONResponse,
         docs_url="/docs" if not settings.is_production else None,
         redoc_url="/redoc" if not settings.is_production else None,
         openapi_url="/openapi.json" if not settings.is_production else None,
     )
     
     # Add custom middleware (order matters - first added = outer layer)
-    app.add_middleware(ErrorHandlingMiddleware)
+    # Erreurs + timing dans une seule couche ; log détaillé en debug seulement
+    app.add_middleware(ObservabilityMiddleware, log_requests=settings.app.debug)
     
+    # CORS configuration for frontend (dev only: en production l'API est
+    # servie same-origin derrière le reverse proxy, qui gère les en-têtes CORS)
     if settings.app.debug:
-        app.add_middleware(RequestLoggingMiddleware)
+        app.add_middleware(
+            CORSMiddleware,
+            allow_origins=[
+                "http://localhost:3000",  # React dev server
+                "http://localhost:5173",  # Vite dev server
+                "http://127.0.0.1:3000",
+                "http://127.0.0.1:5173",
+            ],
+            allow_credentials=True,
+            allow_methods=["GET", "POST", "PATCH", "DELETE"],
+            allow_headers=["*"],
+        )
     
-    # CORS configuration for frontend
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=[
-            "http://localhost:3000",  # React dev server
-            "http://localhost:5173",  # Vite dev server
-            "http://127.0.0.1:3000",
-            "http://127.0.0.1:5173",
-        ] if settings.app.debug else [],  # Restrict in production
-        allow_credentials=True,
-        allow_methods=["GET", "POST", "PATCH", "DELETE"],
-        allow_headers=["*"],
-    )
+    # Include API routers (import différé : SQLAlchemy, repositories et
+    # schémas ne sont chargés qu'à la construction de l'application)
+    from .api.v1.routers import analyses, batches, health
     
-    # Include API routers
     app.include_router(
         analyses.router,
         prefix="/api/v1/analyses",
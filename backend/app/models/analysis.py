@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, Decimal, DateTime, ForeignKey, Text, UniqueConstraint
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Numeric, DateTime, ForeignKey, Text, UniqueConstraint, Index, text
+from sqlalchemy.orm import deferred, relationship
 from datetime import datetime
 from .base import Base
 
@@ -11,20 +11,43 @@ class Analysis(Base):
     batch_id = Column(Integer, ForeignKey('batches.id'), nullable=False)
     isbn_or_asin = Column(String(20), nullable=False)
     title = Column(String(500), nullable=True)
-    current_price = Column(Decimal(10, 2), nullable=True)
-    target_price = Column(Decimal(10, 2), nullable=True)
-    profit = Column(Decimal(10, 2), nullable=True)
-    roi_percent = Column(Decimal(5, 2), nullable=True)
-    velocity_score = Column(Decimal(5, 2), nullable=True)
+    current_price = Column(Numeric(10, 2), nullable=True)
+    target_price = Column(Numeric(10, 2), nullable=True)
+    profit = Column(Numeric(10, 2), nullable=True)
+    roi_percent = Column(Numeric(5, 2), nullable=True)
+    velocity_score = Column(Numeric(5, 2), nullable=True)
     risk_level = Column(String(20), nullable=True)
     bsr = Column(Integer, nullable=True)
-    raw_keepa = Column(Text, nullable=True)
+    raw_keepa = deferred(Column(Text, nullable=True))  # Blob Keepa : chargé à la demande
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # ✅ Unique constraint pour éviter les doublons (PATCH 4)
     __table_args__ = (
         UniqueConstraint('batch_id', 'isbn_or_asin', name='uq_batch_isbn'),
+        # ✅ Index composites (batch_id, tri DESC, id DESC) : seek de la
+        # pagination keyset de list_filtered et top-N (même départage id DESC)
+        # en index scan + LIMIT, sans tri du batch.
+        # NULLS LAST (ordre de la pagination) n'existe qu'en PostgreSQL.
+        Index('idx_analyses_batch_roi_keyset',
+              'batch_id', roi_percent.desc().nulls_last(), id.desc()).ddl_if(dialect='postgresql'),
+        Index('idx_analyses_batch_velocity_keyset',
+              'batch_id', velocity_score.desc().nulls_last(), id.desc()).ddl_if(dialect='postgresql'),
+        Index('idx_analyses_batch_profit_keyset',
+              'batch_id', profit.desc().nulls_last(), id.desc()).ddl_if(dialect='postgresql'),
+        # SQLite refuse NULLS LAST dans un index, mais y trie déjà les NULL en
+        # dernier en DESC : mêmes index sans la clause pour les tests/dev
+        Index('idx_analyses_batch_roi_desc',
+              'batch_id', roi_percent.desc(), id.desc()).ddl_if(dialect='sqlite'),
+        Index('idx_analyses_batch_velocity_desc',
+              'batch_id', velocity_score.desc(), id.desc()).ddl_if(dialect='sqlite'),
+        # BSR : tri ascendant (NULLS LAST par défaut en ASC), tous dialectes
+        Index('idx_analyses_batch_bsr_keyset', 'batch_id', bsr.asc(), id.asc()),
+        # Stratégie balanced : index d'expression sur le score calculé
+        # (même expression que l'ORDER BY de top_n_for_batch)
+        Index('idx_analyses_batch_balanced_keyset',
+              'batch_id', text('(roi_percent * 0.6 + velocity_score * 0.4) DESC NULLS LAST'),
+              id.desc()).ddl_if(dialect='postgresql'),
     )
     
     # Relationship
@@ -1,29 +1,59 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Sequence, Tuple
 from decimal import Decimal
-from sqlalchemy import and_, or_, func, literal
+from sqlalchemy import Numeric, Select, String, and_, or_, any_, bindparam, case, delete, func, lambda_stmt, literal, literal_column, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.interfaces import ORMOption
 
 # ✅ FIX: Import missing exception
 from .base import BaseRepository, FilterCriteria, Page, DuplicateIsbnInBatchError, InvalidFilterFieldError
 from ..models.analysis import Analysis
+from ..models.batch import Batch
+from ..core.exceptions import NotFoundError
 
 class AnalysisRepository(BaseRepository[Analysis]):
     """Repository for Analysis operations with enhanced filtering and sorting"""
     
     # ✅ PATCH 2: Validation stricte des champs
-    SORTABLE_FIELDS = {
+    SORTABLE_FIELDS = frozenset({
         'roi_percent', 'velocity_score', 'profit', 'current_price', 'bsr', 'created_at'
-    }
+    })
     
-    FILTERABLE_FIELDS = {
+    FILTERABLE_FIELDS = frozenset({
         'roi_percent', 'velocity_score', 'profit', 'current_price', 'bsr', 
         'risk_level', 'isbn_or_asin'
+    })
+    
+    BULK_CHUNK_SIZE = 1000
+    
+    # Violation de uq_batch_isbn : PostgreSQL cite le nom de la contrainte,
+    # SQLite seulement les colonnes
+    DUPLICATE_ISBN_MARKERS = ("uq_batch_isbn", "analyses.batch_id, analyses.isbn_or_asin")
+    
+    # ✅ PATCH 3: Ordre Top-N par stratégie (NULLS LAST : ordre des index
+    # composites). Balanced : poids en constantes NUMERIC inlinées (Decimal
+    # exact) pour que PostgreSQL utilise idx_analyses_batch_balanced_keyset
+    TOP_N_ORDER = {
+        "roi": (Analysis.roi_percent.desc().nulls_last(),),
+        "velocity": (Analysis.velocity_score.desc().nulls_last(),),
+        "profit": (Analysis.profit.desc().nulls_last(),),
+        "balanced": ((
+            Analysis.roi_percent * literal_column("0.6", Numeric) +
+            Analysis.velocity_score * literal_column("0.4", Numeric)
+        ).desc().nulls_last(),),
     }
     
     def __init__(self, session: Session):
         super().__init__(session, Analysis)
     
+    def assert_batch_exists(self, batch_id: int) -> None:
+        """Raise NotFoundError unless the batch exists (SELECT 1, no Batch hydration)"""
+        
+        if self.session.scalar(select(literal(1)).where(Batch.id == batch_id)) is None:
+            raise NotFoundError("Batch", batch_id)
+    
     def create_analysis(  # ✅ FIX: Remove async - synchronous SQLAlchemy
         self,
         batch_id: int,
@@ -64,23 +94,144 @@ class AnalysisRepository(BaseRepository[Analysis]):
         except IntegrityError as e:
             # ✅ PATCH 4: Gestion d'erreur avec rollback
             self.session.rollback()  # ✅ FIX: Synchronous rollback
-            if "uq_batch_isbn" in str(e.orig):
+            if any(marker in str(e.orig) for marker in self.DUPLICATE_ISBN_MARKERS):
                 raise DuplicateIsbnInBatchError(
                     f"ISBN/ASIN {isbn_or_asin} already exists in batch {batch_id}"
                 )
             raise  # Re-raise other integrity errors
     
+    def upsert_returning(
+        self,
+        batch_id: int,
+        isbn_or_asin: str,
+        title: Optional[str] = None,
+        current_price: Optional[Decimal] = None,
+        target_price: Optional[Decimal] = None,
+        profit: Optional[Decimal] = None,
+        roi_percent: Optional[Decimal] = None,
+        velocity_score: Optional[Decimal] = None,
+        risk_level: Optional[str] = None,
+        bsr: Optional[int] = None,
+        raw_keepa: Optional[str] = None
+    ) -> Analysis:
+        """Create analysis in one statement: INSERT ... ON CONFLICT DO NOTHING RETURNING
+        
+        Duplicate detection is atomic with the insert (no flush / IntegrityError
+        round-trip); a conflicting (batch_id, isbn_or_asin) raises
+        DuplicateIsbnInBatchError.
+        """
+        
+        # Normaliser ISBN/ASIN
+        isbn_or_asin = isbn_or_asin.strip().upper()
+        
+        stmt = (
+            self._insert()
+            .values(
+                batch_id=batch_id,
+                isbn_or_asin=isbn_or_asin,
+                title=title,
+                current_price=current_price,
+                target_price=target_price,
+                profit=profit,
+                roi_percent=roi_percent,
+                velocity_score=velocity_score,
+                risk_level=risk_level,
+                bsr=bsr,
+                raw_keepa=raw_keepa
+            )
+            .on_conflict_do_nothing(index_elements=['batch_id', 'isbn_or_asin'])
+            .returning(Analysis)
+        )
+        
+        analysis = self.session.scalar(stmt)
+        if analysis is None:
+            raise DuplicateIsbnInBatchError(
+                f"ISBN/ASIN {isbn_or_asin} already exists in batch {batch_id}"
+            )
+        return analysis
+    
+    def bulk_insert(self, rows: Sequence[Dict[str, Any]]) -> int:
+        """Insert many analyses, skipping (batch_id, isbn_or_asin) duplicates
+        
+        One multi-row INSERT ... ON CONFLICT DO NOTHING per BULK_CHUNK_SIZE
+        rows; returns the number of rows actually inserted.
+        """
+        
+        inserted = 0
+        for start in range(0, len(rows), self.BULK_CHUNK_SIZE):
+            chunk = [
+                {**row, "isbn_or_asin": row["isbn_or_asin"].strip().upper()}
+                for row in rows[start:start + self.BULK_CHUNK_SIZE]
+            ]
+            result = self.session.execute(
+                self._insert()
+                .values(chunk)
+                .on_conflict_do_nothing(index_elements=['batch_id', 'isbn_or_asin'])
+            )
+            inserted += result.rowcount
+        return inserted
+    
+    def _insert(self):
+        """Dialect INSERT construct supporting ON CONFLICT (PostgreSQL / SQLite)"""
+        
+        if self.session.get_bind().dialect.name == "postgresql":
+            return postgresql.insert(Analysis)
+        return sqlite.insert(Analysis)
+    
     def list_filtered(  # ✅ FIX: Remove async 
         self,
         batch_id: int,
         filters: Optional[List[FilterCriteria]] = None,
-        isbn_list: Optional[List[str]] = None,  # ✅ PATCH 1: Support isbn_list
+        isbn_list: Optional[Sequence[str]] = None,  # ✅ PATCH 1: Support isbn_list
         sort_by: Optional[str] = None,
         sort_desc: bool = False,
         page: int = 1,
         page_size: int = 50,
+        after: Optional[Tuple[Any, int]] = None,
+        load_options: Sequence[ORMOption] = (),
     ) -> Page[Analysis]:
-        """List analyses with complex filtering including ISBN list"""
+        """List analyses with complex filtering including ISBN list
+        
+        With an `after` cursor (Page.next_after of the previous page) the
+        page is fetched by keyset seek (no COUNT/OFFSET, page/total/pages are
+        None); otherwise by page number. load_options are applied to the row
+        query, e.g. [raiseload("*")] to forbid lazy loads on the page items.
+        """
+        
+        query = self._filtered_query(batch_id, filters, isbn_list)
+        
+        # ✅ PATCH 2: Validation stricte du tri via _paginate
+        if after is not None:
+            return self._paginate_keyset(query, page_size, sort_by, sort_desc, after, load_options)
+        return self._paginate(query, page, page_size, sort_by, sort_desc, load_options)  # ✅ FIX: Remove await
+    
+    def page_statement(
+        self,
+        batch_id: int,
+        filters: Optional[List[FilterCriteria]] = None,
+        isbn_list: Optional[Sequence[str]] = None,
+        sort_by: Optional[str] = None,
+        sort_desc: bool = False,
+        page: int = 1,
+        page_size: int = 50,
+    ) -> Tuple[int, Select]:
+        """Total count + SELECT for one offset page (same order as list_filtered)
+        
+        Rows are not loaded, so callers can stream them (yield_per).
+        """
+        
+        column = self._sort_column(sort_by)
+        query = self._apply_sort(self._filtered_query(batch_id, filters, isbn_list), column, sort_desc)
+        total = self._count(query)
+        return total, query.offset((page - 1) * page_size).limit(page_size).statement
+    
+    def _filtered_query(
+        self,
+        batch_id: int,
+        filters: Optional[List[FilterCriteria]] = None,
+        isbn_list: Optional[Sequence[str]] = None,
+    ):
+        """Base query for a batch with ISBN list and field filters applied"""
         
         query = self.session.query(Analysis).filter(Analysis.batch_id == batch_id)
         
@@ -88,20 +239,25 @@ class AnalysisRepository(BaseRepository[Analysis]):
         if isbn_list:
             # Normaliser la liste
             normalized_isbns = [isbn.strip().upper() for isbn in isbn_list]
-            query = query.filter(Analysis.isbn_or_asin.in_(normalized_isbns))
+            if self.session.get_bind().dialect.name == "postgresql":
+                # Un seul paramètre tableau (= ANY(:isbns)) : texte SQL et plan
+                # préparé identiques quelle que soit la taille de la liste
+                isbns = bindparam("isbns", normalized_isbns, type_=ARRAY(String))
+                query = query.filter(Analysis.isbn_or_asin == any_(isbns))
+            else:
+                query = query.filter(Analysis.isbn_or_asin.in_(normalized_isbns))
         
         # Application des autres filtres
         if filters:
             for criteria in filters:
-                if criteria.field not in self.FILTERABLE_FIELDS:
+                column = self.FILTERABLE_COLUMNS.get(criteria.field)
+                if column is None:
                     raise InvalidFilterFieldError(f"Field {criteria.field} is not filterable")
                 
-                column = getattr(Analysis, criteria.field)
                 condition = self._build_filter_condition(column, criteria)
                 query = query.filter(condition)
         
-        # ✅ PATCH 2: Validation stricte du tri via _paginate
-        return self._paginate(query, page, page_size, sort_by, sort_desc)  # ✅ FIX: Remove await
+        return query
     
     def top_n_for_batch(  # ✅ FIX: Remove async
         self,
@@ -111,28 +267,38 @@ class AnalysisRepository(BaseRepository[Analysis]):
     ) -> List[Analysis]:
         """Get top N analyses for batch using specified strategy"""
         
-        query = self.session.query(Analysis).filter(Analysis.batch_id == batch_id)
+        order = self.TOP_N_ORDER.get(strategy)
+        if order is None:
+            raise ValueError(f"Unknown strategy: {strategy}")
         
-        if strategy == "roi":
-            query = query.order_by(Analysis.roi_percent.desc())
-        elif strategy == "velocity":
-            query = query.order_by(Analysis.velocity_score.desc())
-        elif strategy == "profit":
-            query = query.order_by(Analysis.profit.desc())
-        elif strategy == "balanced":
-            # ✅ PATCH 3: Stratégie balanced avec Decimal précis
-            balanced_score = (
-                Analysis.roi_percent * literal(Decimal("0.6")) +
-                Analysis.velocity_score * literal(Decimal("0.4"))
-            )
-            query = query.order_by(balanced_score.desc())
-        else:
+        # lambda_stmt : SQL compilé une fois par stratégie, puis servi depuis le
+        # cache de l'engine (batch_id / limit passent en paramètres)
+        stmt = lambda_stmt(lambda: select(Analysis).where(Analysis.batch_id == batch_id))
+        # Stable sort avec ID (DESC, comme _apply_sort : mêmes index composites)
+        stmt += lambda s: s.order_by(*order, Analysis.id.desc()).limit(limit)
+        
+        return list(self.session.scalars(stmt))
+    
+    def top_n_isbns(
+        self,
+        batch_id: int,
+        strategy: str = "balanced",
+        limit: int = 10
+    ) -> List[str]:
+        """ISBN/ASIN of the top N analyses (same order as top_n_for_batch)
+        
+        Projects the identifier column only: no ORM rows and no Decimal
+        columns are loaded when only the ranking matters.
+        """
+        
+        order = self.TOP_N_ORDER.get(strategy)
+        if order is None:
             raise ValueError(f"Unknown strategy: {strategy}")
         
-        # Stable sort avec ID
-        query = query.order_by(Analysis.id.asc())
+        stmt = lambda_stmt(lambda: select(Analysis.isbn_or_asin).where(Analysis.batch_id == batch_id))
+        stmt += lambda s: s.order_by(*order, Analysis.id.desc()).limit(limit)
         
-        return query.limit(limit).all()
+        return list(self.session.scalars(stmt))
     
     def count_by_thresholds(  # ✅ FIX: Remove async
         self,
@@ -141,61 +307,51 @@ class AnalysisRepository(BaseRepository[Analysis]):
         velocity_threshold: Optional[Decimal] = None,
         profit_threshold: Optional[Decimal] = None
     ) -> Dict[str, int]:
-        """Count analyses by various thresholds"""
+        """Count analyses by various thresholds
+        
+        Single aggregate query (conditional SUMs): one scan of the batch
+        instead of one COUNT round trip per threshold.
+        """
         
-        base_query = self.session.query(Analysis).filter(Analysis.batch_id == batch_id)
+        def count_if(condition):
+            return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
         
-        results = {
-            "total": base_query.count()
-        }
+        columns = [func.count(Analysis.id).label("total")]
         
         if roi_threshold:
-            results["high_roi"] = base_query.filter(
-                Analysis.roi_percent >= roi_threshold
-            ).count()
+            columns.append(count_if(Analysis.roi_percent >= roi_threshold).label("high_roi"))
         
         if velocity_threshold:
-            results["high_velocity"] = base_query.filter(
-                Analysis.velocity_score >= velocity_threshold
-            ).count()
+            columns.append(count_if(Analysis.velocity_score >= velocity_threshold).label("high_velocity"))
         
         if profit_threshold:
-            results["high_profit"] = base_query.filter(
-                Analysis.profit >= profit_threshold
-            ).count()
+            columns.append(count_if(Analysis.profit >= profit_threshold).label("high_profit"))
         
         # Golden opportunities (multi-criteria)
         if all([roi_threshold, velocity_threshold, profit_threshold]):
-            results["golden"] = base_query.filter(
-                and_(
-                    Analysis.roi_percent >= roi_threshold,
-                    Analysis.velocity_score >= velocity_threshold,
-                    Analysis.profit >= profit_threshold
-                )
-            ).count()
+            columns.append(count_if(and_(
+                Analysis.roi_percent >= roi_threshold,
+                Analysis.velocity_score >= velocity_threshold,
+                Analysis.profit >= profit_threshold
+            )).label("golden"))
         
-        return results
+        row = self.session.execute(select(*columns).where(Analysis.batch_id == batch_id)).one()
+        return {key: int(value) for key, value in row._asdict().items()}
     
     def delete_by_batch(self, batch_id: int) -> int:  # ✅ FIX: Remove async
-        """Delete all analyses for a batch"""
-        count = self.session.query(Analysis).filter(
-            Analysis.batch_id == batch_id
-        ).count()
-        
-        self.session.query(Analysis).filter(
-            Analysis.batch_id == batch_id
-        ).delete()
-        
-        return count
+        """Delete all analyses for a batch (one DELETE, count from rowcount)"""
+        result = self.session.execute(
+            delete(Analysis)
+            .where(Analysis.batch_id == batch_id)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount
     
     def delete_by_ids(self, analysis_ids: List[int]) -> int:  # ✅ FIX: Remove async
-        """Delete analyses by ID list"""
-        count = self.session.query(Analysis).filter(
-            Analysis.id.in_(analysis_ids)
-        ).count()
-        
-        self.session.query(Analysis).filter(
-            Analysis.id.in_(analysis_ids)
-        ).delete(synchronize_session=False)
-        
-        return count
\ No newline at end of file
+        """Delete analyses by ID list (one DELETE, count from rowcount)"""
+        result = self.session.execute(
+            delete(Analysis)
+            .where(Analysis.id.in_(analysis_ids))
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount
@@ -1,9 +1,12 @@
+import operator
+from dataclasses import dataclass
 from enum import Enum
-from typing import List, Union, Any, Optional, TypeVar, Generic
+from typing import Dict, List, Union, Any, Optional, Sequence, Tuple, TypeVar, Generic
 from decimal import Decimal
 from pydantic import BaseModel
-from sqlalchemy import Column, and_, asc, desc
-from sqlalchemy.orm import Session
+from sqlalchemy import Column, and_, or_, asc, desc, func, select, tuple_
+from sqlalchemy.orm import InstrumentedAttribute, Session
+from sqlalchemy.orm.interfaces import ORMOption
 from sqlalchemy.exc import IntegrityError
 
 T = TypeVar('T')
@@ -16,23 +19,35 @@ class FilterCondition(str, Enum):
     GT = "gt"
     LT = "lt"
 
+# Comparison conditions -> operator, resolved once at import (IN handled apart)
+_OPS = {
+    FilterCondition.EQ: operator.eq,
+    FilterCondition.GTE: operator.ge,
+    FilterCondition.LTE: operator.le,
+    FilterCondition.GT: operator.gt,
+    FilterCondition.LT: operator.lt,
+}
+
 class FilterCriteria(BaseModel):
     field: str
     condition: FilterCondition  
     value: Union[str, int, float, Decimal, List[str]]  # ✅ Support List[str] pour IN
 
-class Page(BaseModel, Generic[T]):
-    """Generic pagination container"""
+@dataclass(slots=True)
+class Page(Generic[T]):
+    """Generic pagination container (page/total/pages are None in keyset mode)
+    
+    Plain dataclass: repositories hand back ORM rows as-is, no per-item
+    validation. Routers convert once to PageOut at the API boundary.
+    """
     items: List[T]
-    page: int
+    page: Optional[int]
     page_size: int
-    total: int
-    pages: int
+    total: Optional[int]
+    pages: Optional[int]
     has_next: bool
     has_prev: bool
-    
-    class Config:
-        arbitrary_types_allowed = True
+    next_after: Optional[Tuple[Any, int]] = None  # (sort_value, id) cursor of the next page
 
 class InvalidFilterFieldError(Exception):
     """Raised when trying to filter on invalid field"""
@@ -49,33 +64,127 @@ class DuplicateIsbnInBatchError(Exception):
 class BaseRepository(Generic[T]):
     """Enhanced base repository with advanced pagination and filtering"""
     
-    FILTERABLE_FIELDS: set = set()
-    SORTABLE_FIELDS: set = set()  # ✅ PATCH 2: Validation stricte
+    FILTERABLE_FIELDS: frozenset = frozenset()
+    SORTABLE_FIELDS: frozenset = frozenset()  # ✅ PATCH 2: Validation stricte
+    
+    # field -> colonne mappée, résolus une fois par sous-classe (voir __init__)
+    SORTABLE_COLUMNS: Dict[str, InstrumentedAttribute] = {}
+    FILTERABLE_COLUMNS: Dict[str, InstrumentedAttribute] = {}
     
     def __init__(self, session: Session, model_class):
         self.session = session
         self.model_class = model_class
+        cls = type(self)
+        if "SORTABLE_COLUMNS" not in cls.__dict__:
+            # Premier repository de cette classe : pré-résoudre les descripteurs
+            cls.SORTABLE_COLUMNS = {name: getattr(model_class, name) for name in cls.SORTABLE_FIELDS}
+            cls.FILTERABLE_COLUMNS = {name: getattr(model_class, name) for name in cls.FILTERABLE_FIELDS}
     
     def _build_filter_condition(self, column: Column, criteria: FilterCriteria):
         """Build SQLAlchemy filter condition from criteria"""
         
-        if criteria.condition == FilterCondition.EQ:
-            return column == criteria.value
-        elif criteria.condition == FilterCondition.IN:
+        if criteria.condition is FilterCondition.IN:
             # ✅ PATCH 1: Support pour IN avec liste de valeurs
             if not isinstance(criteria.value, list):
                 raise ValueError(f"IN condition requires list value, got {type(criteria.value)}")
             return column.in_(criteria.value)
-        elif criteria.condition == FilterCondition.GTE:
-            return column >= criteria.value
-        elif criteria.condition == FilterCondition.LTE:
-            return column <= criteria.value
-        elif criteria.condition == FilterCondition.GT:
-            return column > criteria.value
-        elif criteria.condition == FilterCondition.LT:
-            return column < criteria.value
-        else:
+        op = _OPS.get(criteria.condition)
+        if op is None:
             raise ValueError(f"Unsupported filter condition: {criteria.condition}")
+        return op(column, criteria.value)
+    
+    def _sort_column(self, sort_by: Optional[str]):
+        """Resolve and validate the sort column (None = id only)"""
+        
+        # ✅ PATCH 2: Validation stricte des champs de tri
+        if not sort_by:
+            return None
+        if sort_by not in self.SORTABLE_FIELDS:
+            raise InvalidSortFieldError(f"Field {sort_by} is not sortable. Allowed: {self.SORTABLE_FIELDS}")
+        return self.SORTABLE_COLUMNS[sort_by]
+    
+    def _apply_sort(self, query, column, sort_desc: bool):
+        """ORDER BY sort column (NULLS LAST) then id in the same direction
+        
+        Offset and keyset pagination share this ordering so a cursor taken
+        from any page can continue the listing.
+        """
+        id_column = self.model_class.id
+        if column is None:
+            # Default stable sorting
+            return query.order_by(asc(id_column))
+        if sort_desc:
+            return query.order_by(desc(column).nulls_last(), desc(id_column))
+        return query.order_by(asc(column).nulls_last(), asc(id_column))
+    
+    def _seek_condition(self, column, sort_desc: bool, after: Tuple[Any, int]):
+        """WHERE clause resuming right after the (sort_value, id) cursor"""
+        id_column = self.model_class.id
+        after_value, after_id = after
+        
+        if column is None:
+            return id_column > after_id
+        
+        id_after = id_column < after_id if sort_desc else id_column > after_id
+        if after_value is None:
+            # Already in the NULLS LAST tail: only ids remain to compare
+            return and_(column.is_(None), id_after)
+        
+        row = tuple_(column, id_column)
+        cursor = tuple_(after_value, after_id)
+        return or_(row < cursor if sort_desc else row > cursor, column.is_(None))
+    
+    def _count(self, query) -> int:
+        """Total rows matching query's WHERE clause
+        
+        Bare SELECT count(*) FROM table WHERE ...: no ORDER BY and no
+        subquery over the projected columns (Query.count() wraps the whole
+        SELECT), so PostgreSQL can answer from an index on the filter columns.
+        """
+        stmt = select(func.count()).select_from(self.model_class)
+        if query.whereclause is not None:
+            stmt = stmt.where(query.whereclause)
+        return self.session.scalar(stmt)
+    
+    def _next_after(self, items: List[T], column, has_next: bool) -> Optional[Tuple[Any, int]]:
+        """Keyset cursor (sort_value, id) of the last item, when a next page exists"""
+        if not has_next or not items:
+            return None
+        last = items[-1]
+        return (getattr(last, column.key) if column is not None else None, last.id)
+    
+    def _paginate_keyset(
+        self,
+        query,
+        page_size: int,
+        sort_by: Optional[str] = None,
+        sort_desc: bool = False,
+        after: Optional[Tuple[Any, int]] = None,
+        load_options: Sequence[ORMOption] = ()
+    ) -> Page[T]:
+        """Execute keyset (seek) paginated query: no COUNT, no OFFSET"""
+        
+        column = self._sort_column(sort_by)
+        query = query.options(*load_options)
+        if after is not None:
+            query = query.filter(self._seek_condition(column, sort_desc, after))
+        query = self._apply_sort(query, column, sort_desc)
+        
+        # One extra row tells whether a next page exists
+        rows = query.limit(page_size + 1).all()
+        items = rows[:page_size]
+        has_next = len(rows) > page_size
+        
+        return Page(
+            items=items,
+            page=None,
+            page_size=page_size,
+            total=None,
+            pages=None,
+            has_next=has_next,
+            has_prev=after is not None,
+            next_after=self._next_after(items, column, has_next)
+        )
     
     def _paginate(  # ✅ FIX: Remove async for synchronous SQLAlchemy
         self, 
@@ -83,30 +192,37 @@ class BaseRepository(Generic[T]):
         page: int, 
         page_size: int, 
         sort_by: Optional[str] = None,
-        sort_desc: bool = False
+        sort_desc: bool = False,
+        load_options: Sequence[ORMOption] = ()
     ) -> Page[T]:
-        """Execute paginated query with sorting"""
+        """Execute paginated query with sorting
         
-        # ✅ PATCH 2: Validation stricte des champs de tri
-        if sort_by:
-            if sort_by not in self.SORTABLE_FIELDS:
-                raise InvalidSortFieldError(f"Field {sort_by} is not sortable. Allowed: {self.SORTABLE_FIELDS}")
-            
-            column = getattr(self.model_class, sort_by)
-            if sort_desc:
-                query = query.order_by(desc(column), asc(self.model_class.id))
-            else:
-                query = query.order_by(asc(column), asc(self.model_class.id))
-        else:
-            # Default stable sorting
-            query = query.order_by(asc(self.model_class.id))
+        load_options (e.g. raiseload("*")) apply to the query loading the
+        page rows.
+        """
+        
+        column = self._sort_column(sort_by)
+        query = self._apply_sort(query, column, sort_desc)
         
         # Get total count
-        total = query.count()
+        total = self._count(query)
         
-        # Apply pagination
+        # Apply pagination (deferred join: sort/offset over ids only, then
+        # fetch full rows for the page so wide columns skip the sort node)
         offset = (page - 1) * page_size
-        items = query.offset(offset).limit(page_size).all()
+        page_ids = (
+            query.with_entities(self.model_class.id)
+            .offset(offset)
+            .limit(page_size)
+            .subquery()
+        )
+        items = self._apply_sort(
+            self.session.query(self.model_class).options(*load_options).join(
+                page_ids, self.model_class.id == page_ids.c.id
+            ),
+            column,
+            sort_desc
+        ).all()
         
         # Calculate pagination metadata
         pages = (total + page_size - 1) // page_size
@@ -120,5 +236,6 @@ class BaseRepository(Generic[T]):
             total=total,
             pages=pages,
             has_next=has_next,
-            has_prev=has_prev
+            has_prev=has_prev,
+            next_after=self._next_after(items, column, has_next)
         )
\ No newline at end of file
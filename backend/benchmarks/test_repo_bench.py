@@ -0,0 +1,105 @@
+"""Microbenchmarks des méthodes chaudes d'AnalysisRepository (pytest-benchmark)
+
+    pytest backend/benchmarks --benchmark-only
+"""
+import itertools
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+pytest.importorskip("pytest_benchmark")
+
+from backend.app.models.analysis import Analysis, Base
+from backend.app.models.batch import Batch
+from backend.app.repositories.analysis import AnalysisRepository
+from backend.app.repositories.base import FilterCriteria, FilterCondition
+
+# Warmup + GC désactivé pendant les mesures, au moins 5 rounds
+pytestmark = pytest.mark.benchmark(
+    warmup=True,
+    warmup_iterations=2,
+    disable_gc=True,
+    min_rounds=5
+)
+
+SEED_ROWS = 1000
+
+@pytest.fixture(scope="session")
+def seeded_1k():
+    """In-memory engine with one batch of SEED_ROWS analyses (single executemany)"""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool
+    )
+    Base.metadata.create_all(engine)
+    
+    with Session(engine) as session:
+        session.add(Batch(id=1, name="Bench Batch"))
+        session.flush()
+        session.execute(insert(Analysis), [
+            dict(
+                batch_id=1,
+                isbn_or_asin=f"ISBN{i:06d}",
+                roi_percent=Decimal(i % 100),
+                velocity_score=Decimal(i * 7 % 100),
+                profit=Decimal(i % 50),
+                bsr=i * 10
+            )
+            for i in range(SEED_ROWS)
+        ])
+        session.commit()
+    
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def analysis_repo(seeded_1k):
+    """Repository on a connection whose transaction is rolled back afterwards"""
+    connection = seeded_1k.connect()
+    trans = connection.begin()
+    session = Session(bind=connection, autoflush=False, expire_on_commit=False)
+    
+    yield AnalysisRepository(session)
+    
+    session.close()
+    trans.rollback()
+    connection.close()
+
+def test_list_filtered_bench(benchmark, analysis_repo):
+    """list_filtered: ISBN list + ROI filter + sort (COUNT + deferred join page)"""
+    isbns = [f"ISBN{i:06d}" for i in range(0, SEED_ROWS, 10)]
+    filters = [FilterCriteria(field="roi_percent", condition=FilterCondition.GTE, value=Decimal("20"))]
+    
+    result = benchmark(
+        analysis_repo.list_filtered,
+        batch_id=1,
+        isbn_list=isbns,
+        filters=filters,
+        sort_by="roi_percent",
+        sort_desc=True
+    )
+    
+    assert result.total > 0
+
+@pytest.mark.parametrize("strategy", ["balanced", "roi", "velocity", "profit"])
+def test_top_n_for_batch_bench(benchmark, analysis_repo, strategy):
+    """top_n_for_batch per strategy (balanced = Decimal weighted score)"""
+    result = benchmark(analysis_repo.top_n_for_batch, batch_id=1, strategy=strategy, limit=10)
+    
+    assert len(result) == 10
+
+def test_create_analysis_bench(benchmark, analysis_repo):
+    """create_analysis: normalization + add + flush, one new ISBN per call"""
+    isbns = (f" bench{i:06d} " for i in itertools.count())
+    
+    result = benchmark(lambda: analysis_repo.create_analysis(
+        batch_id=1,
+        isbn_or_asin=next(isbns),
+        roi_percent=Decimal("25.5")
+    ))
+    
+    assert result.isbn_or_asin.startswith("BENCH")
@@ -9,22 +9,36 @@
 -- ALTER TABLE analyses ADD CONSTRAINT uq_batch_isbn UNIQUE (batch_id, isbn_or_asin);
 
 -- Performance indexes for filtering and sorting
-CREATE INDEX IF NOT EXISTS idx_analyses_batch_id ON analyses (batch_id);
-CREATE INDEX IF NOT EXISTS idx_analyses_roi_percent ON analyses (roi_percent DESC);
-CREATE INDEX IF NOT EXISTS idx_analyses_velocity_score ON analyses (velocity_score DESC);
-CREATE INDEX IF NOT EXISTS idx_analyses_profit ON analyses (profit DESC);
-CREATE INDEX IF NOT EXISTS idx_analyses_bsr ON analyses (bsr ASC);
 CREATE INDEX IF NOT EXISTS idx_analyses_created_at ON analyses (created_at DESC);
 
--- Composite index for balanced strategy (most common query)
-CREATE INDEX IF NOT EXISTS idx_analyses_balanced_strategy ON analyses (batch_id, roi_percent DESC, velocity_score DESC);
+-- Keyset pagination and top-N (roi_percent DESC NULLS LAST, id DESC) per batch
+CREATE INDEX IF NOT EXISTS idx_analyses_batch_roi_keyset ON analyses (batch_id, roi_percent DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS idx_analyses_batch_velocity_keyset ON analyses (batch_id, velocity_score DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS idx_analyses_batch_profit_keyset ON analyses (batch_id, profit DESC NULLS LAST, id DESC);
 
--- Composite index for golden opportunities (multi-threshold queries)
-CREATE INDEX IF NOT EXISTS idx_analyses_golden_ops ON analyses (batch_id, roi_percent DESC, velocity_score DESC, profit DESC);
+-- BSR sort (ascending)
+CREATE INDEX IF NOT EXISTS idx_analyses_batch_bsr_keyset ON analyses (batch_id, bsr ASC, id ASC);
+
+-- Balanced strategy score (expression and id DESC must match top_n_for_batch ORDER BY)
+CREATE INDEX IF NOT EXISTS idx_analyses_batch_balanced_keyset ON analyses (batch_id, (roi_percent * 0.6 + velocity_score * 0.4) DESC NULLS LAST, id DESC);
 
 -- ISBN lookup optimization
 CREATE INDEX IF NOT EXISTS idx_analyses_isbn_lookup ON analyses (isbn_or_asin);
 
+-- Superseded by the (batch_id, ...) composites above: every analyses query
+-- is batch-scoped, and uq_batch_isbn already leads with batch_id
+DROP INDEX IF EXISTS idx_analyses_batch_id;
+DROP INDEX IF EXISTS idx_analyses_roi_percent;
+DROP INDEX IF EXISTS idx_analyses_velocity_score;
+DROP INDEX IF EXISTS idx_analyses_profit;
+DROP INDEX IF EXISTS idx_analyses_bsr;
+DROP INDEX IF EXISTS idx_analyses_balanced_strategy;
+DROP INDEX IF EXISTS idx_analyses_golden_ops;
+DROP INDEX IF EXISTS idx_analyses_batch_balanced_score;
+DROP INDEX IF EXISTS idx_analyses_batch_roi_topn;
+DROP INDEX IF EXISTS idx_analyses_batch_velocity_topn;
+DROP INDEX IF EXISTS idx_analyses_batch_profit_topn;
+
 -- ============================================================================
 -- BATCHES TABLE INDEXES  
 -- ============================================================================
@@ -45,8 +59,8 @@ CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at DESC);
 -- QUERY OPTIMIZATION NOTES
 -- ============================================================================
 
--- idx_analyses_balanced_strategy: Optimizes top_n_for_batch(balanced)
--- idx_analyses_golden_ops: Optimizes count_by_thresholds with multiple criteria
--- idx_analyses_batch_id: Essential for list_filtered base query
--- idx_analyses_roi_percent: Profit Hunter strategy sorting
--- idx_analyses_velocity_score: Velocity strategy sorting
+-- idx_analyses_batch_roi_keyset: Seek pagination WHERE (roi_percent, id) < (:roi, :id) and top_n_for_batch(roi)
+-- idx_analyses_batch_velocity_keyset / idx_analyses_batch_profit_keyset: same for the other sort keys
+-- idx_analyses_batch_bsr_keyset: list_filtered(sort_by="bsr") as an index range scan
+-- idx_analyses_batch_balanced_keyset: top_n_for_batch(balanced) without sorting the whole batch
+-- uq_batch_isbn (batch_id, isbn_or_asin): batch_id prefix for list_filtered and count_by_thresholds
@@ -1,50 +1,248 @@
 import pytest
-from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+import httpx
+from sqlalchemy import create_engine, insert
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool, StaticPool
+from datetime import datetime
 from decimal import Decimal
+from types import SimpleNamespace
+import time
 import json
 
 from backend.app.main import create_app
 from backend.app.models import Base, User, UserRole, Batch, BatchStatus, Analysis
-from backend.app.api.v1.deps.database import get_sync_db_dependency
+from backend.app.api.v1.deps.database import get_async_db_dependency
+from backend.app.api.v1.deps.cache import ResponseCache, get_cache, STATS_KEY, batch_key, topn_key, topn_index
+
+pytestmark = pytest.mark.anyio
+
+FROZEN_NOW = datetime(2024, 1, 1)
+
+# Endpoint URLs (query strings are passed as params=, encoded by httpx)
+URL_ROOT = "/"
+URL_HEALTH = "/api/v1/health/"
+URL_HEALTH_DB = "/api/v1/health/db"
+URL_HEALTH_POOL = "/api/v1/health/db/pool"
+URL_ANALYSES = "/api/v1/analyses/"
+URL_ANALYSES_BULK = "/api/v1/analyses/bulk"
+URL_ANALYSES_TOP = "/api/v1/analyses/top"
+URL_BATCHES = "/api/v1/batches/"
+URL_BATCHES_STATS = "/api/v1/batches/stats"
+URL_BATCH = "/api/v1/batches/1"
+URL_BATCH_MISSING = "/api/v1/batches/999"
+URL_BATCH_STATUS = "/api/v1/batches/1/status"
+
+# Request bodies serialized once at import, sent as raw JSON bytes
+_JSON_HEADERS = {"content-type": "application/json"}
+
+_ANALYSIS_PAYLOAD_JSON = json.dumps({
+    "batch_id": 1,
+    "isbn_or_asin": "ISBN004",
+    "title": "New Test Book",
+    "roi_percent": 55.5,
+    "velocity_score": 65.0,
+    "profit": 20.00,
+    "current_price": 30.00,
+    "bsr": 12000
+}).encode()
+
+_DUPLICATE_PAYLOAD_JSON = json.dumps({
+    "batch_id": 1,
+    "isbn_or_asin": "ISBN001",  # Already exists
+    "title": "Duplicate Book",
+    "roi_percent": 25.0
+}).encode()
+
+_BULK_PAYLOAD_JSON = json.dumps([
+    {"batch_id": 1, "isbn_or_asin": "ISBN001", "roi_percent": 25.0},  # Already exists
+    {"batch_id": 1, "isbn_or_asin": "isbn004", "roi_percent": 30.0},
+    {"batch_id": 1, "isbn_or_asin": "ISBN005", "velocity_score": 40.0}
+]).encode()
+
+_STATUS_DONE_JSON = json.dumps({"status": "DONE", "items_processed": 3}).encode()
+_STATUS_PENDING_JSON = json.dumps({"status": "PENDING"}).encode()
+
+# Base SQLite en mémoire nommée, en cache partagé : toutes les connexions du
+# process (fixtures sync, engine aiosqlite de l'app, sonde de santé) voient
+# les mêmes tables. Chaque worker pytest-xdist est un process séparé, donc
+# une base distincte.
+_SHARED_MEMORY_DB = "file:shared-test?mode=memory&cache=shared&uri=true"
 
 @pytest.fixture(scope="session")
 def engine():
-    """Create test database engine"""
-    engine = create_engine("sqlite:///:memory:", echo=False)
+    """Create test database engine (schema created once)
+    
+    The StaticPool connection stays open for the whole session, which keeps
+    the shared in-memory database alive.
+    """
+    engine = create_engine(
+        f"sqlite:///{_SHARED_MEMORY_DB}",
+        echo=False,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool
+    )
     Base.metadata.create_all(engine)
     yield engine
     engine.dispose()
 
-@pytest.fixture
-def db_session(engine):
-    """Create database session for each test"""
-    Session = sessionmaker(bind=engine, expire_on_commit=False)
+@pytest.fixture(scope="session")
+def async_engine(engine):
+    """Create async test engine (aiosqlite) on the same in-memory database"""
+    return create_async_engine(f"sqlite+aiosqlite:///{_SHARED_MEMORY_DB}", poolclass=NullPool)
+
+def _clear_tables(session):
+    """Delete every row (committed through the app or the fixtures)"""
+    session.expunge_all()
+    for table in reversed(Base.metadata.sorted_tables):
+        session.execute(table.delete())
+    session.commit()
+
+@pytest.fixture(scope="class")
+def class_db_session(engine):
+    """Database session shared by the tests of one class, tables cleared afterwards"""
+    Session = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
     session = Session()
     yield session
     session.rollback()
+    _clear_tables(session)
     session.close()
 
-@pytest.fixture
-def client(db_session):
-    """Create test client with database dependency override"""
-    app = create_app()
+class _FrozenDatetime(datetime):
+    """datetime whose utcnow() is pinned to FROZEN_NOW"""
     
-    def override_get_db():
-        try:
-            yield db_session
-        finally:
-            pass
+    @classmethod
+    def utcnow(cls):
+        return FROZEN_NOW
+
+@pytest.fixture(scope="session", autouse=True)
+def frozen_clock():
+    """Pin the wall clocks read by the health and batch handlers
+    
+    Timestamps and response_time_ms become constants (reproducible payloads).
+    time.monotonic stays real: it only drives the /health/db probe TTL.
+    """
+    from backend.app.api.v1.routers import batches, health
     
-    app.dependency_overrides[get_sync_db_dependency] = override_get_db
+    frozen_time = SimpleNamespace(
+        time=lambda: FROZEN_NOW.timestamp(),
+        monotonic=time.monotonic
+    )
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(health, "time", frozen_time)
+        mp.setattr(batches, "datetime", _FrozenDatetime)
+        yield
+
+@pytest.fixture(autouse=True)
+def fresh_health_probe(monkeypatch):
+    """Drop the cached /health/db result so every test runs the real SELECT 1"""
+    from backend.app.api.v1.routers import health
     
-    with TestClient(app) as client:
-        yield client
+    monkeypatch.setattr(health, "_last_check_result", None)
+
+@pytest.fixture(scope="session")
+def app():
+    """Build the FastAPI app once (routes, schemas, OpenAPI) for the whole session"""
+    return create_app()
+
+@pytest.fixture(scope="session")
+def override_get_db(async_engine):
+    """Async session dependency bound to the test database"""
+    AsyncSession = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+    
+    async def override_get_db():
+        async with AsyncSession() as session:
+            yield session
+    
+    return override_get_db
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    """One asyncio event loop for the whole session (session-scoped client)"""
+    return "asyncio"
+
+@pytest.fixture(scope="session")
+async def client(app, override_get_db, async_engine):
+    """Async HTTP client over the ASGI app, shared by every test
+    
+    No TestClient thread/portal per test: the app lifespan runs once and
+    requests go straight through httpx.ASGITransport. The health probe and
+    pool metrics read core.database.async_engine, pointed at the test database.
+    """
+    from backend.app.core import database
+    
+    app.dependency_overrides[get_async_db_dependency] = override_get_db
+    
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(database, "async_engine", async_engine)
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=app), base_url="http://test"
+            ) as client:
+                yield client
+    
+    app.dependency_overrides.clear()
+
+class _FakePipeline:
+    """Buffers commands like redis.asyncio's pipeline, replays them on execute()"""
+    
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+    
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return command
+    
+    async def execute(self):
+        return [await getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        return False
+
+class _FakeRedis:
+    """In-memory stand-in for the async Redis client wrapped by ResponseCache"""
+    
+    def __init__(self):
+        self.store = {}
+    
+    async def get(self, key):
+        return self.store.get(key)
+    
+    async def set(self, key, value, ex=None):
+        self.store[key] = value
+    
+    async def delete(self, *keys):
+        for key in keys:
+            self.store.pop(key, None)
+    
+    async def sadd(self, key, *members):
+        self.store.setdefault(key, set()).update(members)
+    
+    async def smembers(self, key):
+        return set(self.store.get(key, ()))
+    
+    async def expire(self, key, seconds):
+        pass
+    
+    def pipeline(self, transaction=True):
+        return _FakePipeline(self)
 
 @pytest.fixture
-def sample_data(db_session):
-    """Create sample data for testing"""
+def fake_cache(app):
+    """Enable the response cache for one test, backed by _FakeRedis"""
+    fake = _FakeRedis()
+    app.dependency_overrides[get_cache] = lambda: ResponseCache(fake)
+    yield fake
+    app.dependency_overrides.pop(get_cache)
+
+def _seed_sample_data(db_session):
+    """Insert the reference user, batch and 3 analyses (committed)"""
     # Create user
     user = User(
         email="test@arbitragevault.com",
@@ -63,9 +261,9 @@ def sample_data(db_session):
     )
     db_session.add(batch)
     
-    # Create analyses
+    # Create analyses (one executemany INSERT, no per-object unit of work)
     analyses = [
-        Analysis(
+        dict(
             batch_id=1,
             isbn_or_asin="ISBN001",
             title="Test Book 1",
@@ -75,7 +273,7 @@ def sample_data(db_session):
             current_price=Decimal("35.99"),
             bsr=15420
         ),
-        Analysis(
+        dict(
             batch_id=1,
             isbn_or_asin="ISBN002", 
             title="Test Book 2",
@@ -85,7 +283,7 @@ def sample_data(db_session):
             current_price=Decimal("42.50"),
             bsr=28750
         ),
-        Analysis(
+        dict(
             batch_id=1,
             isbn_or_asin="ISBN003",
             title="Test Book 3", 
@@ -97,57 +295,98 @@ def sample_data(db_session):
         )
     ]
     
-    for analysis in analyses:
-        db_session.add(analysis)
+    db_session.flush()  # Batch row first (FK)
+    # RETURNING : ids générés récupérés dans le même aller-retour
+    rows = db_session.execute(
+        insert(Analysis).returning(Analysis.id, Analysis.isbn_or_asin, sort_by_parameter_order=True),
+        analyses
+    ).all()
     
     db_session.commit()
     
     return {
         "user": user,
         "batch": batch,
-        "analyses": analyses
+        "analyses": rows  # (id, isbn_or_asin) in insertion order
     }
 
+def _seed_unsized_batch(db_session, status=BatchStatus.RUNNING):
+    """Batch 2 with items_total=0 (not finalized) and 2 analyses (committed)"""
+    db_session.add(Batch(
+        id=2, name="Unsized Batch", status=status,
+        items_total=0, items_processed=1
+    ))
+    db_session.flush()
+    db_session.execute(insert(Analysis), [
+        dict(batch_id=2, isbn_or_asin="ISBN201", roi_percent=Decimal("20.0")),
+        dict(batch_id=2, isbn_or_asin="ISBN202", roi_percent=Decimal("30.0")),
+    ])
+    db_session.commit()
+
+@pytest.fixture(scope="class")
+def sample_data(class_db_session):
+    """Sample data built once per test class (tests mostly read it)"""
+    return _seed_sample_data(class_db_session)
+
+@pytest.fixture
+def restore_sample_data(class_db_session, sample_data):
+    """For tests writing through the API: reset the class data afterwards
+    
+    The app commits on its own aiosqlite connections, so a SAVEPOINT on the
+    fixture session cannot undo those writes; the rows are re-seeded instead.
+    """
+    yield sample_data
+    _clear_tables(class_db_session)
+    _seed_sample_data(class_db_session)
+
 class TestHealthEndpoints:
     """Test health check endpoints"""
     
-    def test_health_check(self, client):
+    async def test_health_check(self, client):
         """Test basic health check"""
-        response = client.get("/api/v1/health/")
+        response = await client.get(URL_HEALTH)
         assert response.status_code == 200
         
         data = response.json()
         assert data["status"] == "healthy"
         assert "version" in data
-        assert "timestamp" in data
+        assert data["timestamp"] == FROZEN_NOW.timestamp()
     
-    def test_database_health_check(self, client, sample_data):
+    async def test_database_health_check(self, client, sample_data):
         """Test database health check"""
-        response = client.get("/api/v1/health/db")
+        response = await client.get(URL_HEALTH_DB)
         assert response.status_code == 200
         
         data = response.json()
         assert data["status"] == "healthy"
         assert data["database"] == "connected"
         assert "response_time_ms" in data
+    
+    async def test_probe_engine_follows_async_engine_and_is_disposed(self, client, async_engine, sample_data):
+        """Test the probe engine targets core.database.async_engine and is released on dispose"""
+        from backend.app.api.v1.routers import health
+        
+        await health.dispose_probe_engine()
+        assert health._get_probe_engine().url == async_engine.url
+        
+        await health.dispose_probe_engine()
+        assert health._probe_engine is None
+    
+    async def test_database_pool_status(self, client):
+        """Test pool metrics endpoint"""
+        response = await client.get(URL_HEALTH_POOL)
+        assert response.status_code == 200
+        
+        data = response.json()
+        assert "pool_class" in data
+        assert "status" in data
 
 class TestAnalysisEndpoints:
     """Test analysis endpoints"""
     
-    def test_create_analysis(self, client, sample_data):
+    async def test_create_analysis(self, client, restore_sample_data):
         """Test POST /api/v1/analyses"""
-        analysis_data = {
-            "batch_id": 1,
-            "isbn_or_asin": "ISBN004",
-            "title": "New Test Book",
-            "roi_percent": 55.5,
-            "velocity_score": 65.0,
-            "profit": 20.00,
-            "current_price": 30.00,
-            "bsr": 12000
-        }
-        
-        response = client.post("/api/v1/analyses/", json=analysis_data)
+        response = await client.post(URL_ANALYSES, content=_ANALYSIS_PAYLOAD_JSON, headers=_JSON_HEADERS)
         assert response.status_code == 201
         
         data = response.json()
@@ -156,119 +395,167 @@ class TestAnalysisEndpoints:
         assert float(data["roi_percent"]) == 55.5
         assert "id" in data
     
-    def test_create_analysis_duplicate_error(self, client, sample_data):
+    async def test_create_analysis_duplicate_error(self, client, sample_data):
         """Test duplicate ISBN detection"""
-        analysis_data = {
-            "batch_id": 1,
-            "isbn_or_asin": "ISBN001",  # Already exists
-            "title": "Duplicate Book",
-            "roi_percent": 25.0
-        }
-        
-        response = client.post("/api/v1/analyses/", json=analysis_data)
+        response = await client.post(URL_ANALYSES, content=_DUPLICATE_PAYLOAD_JSON, headers=_JSON_HEADERS)
         assert response.status_code == 409  # Conflict
         
-        data = response.json()
+        data = response.json()["detail"]  # HTTPException body
         assert data["error"] == "duplicate_isbn"
         assert "ISBN001" in data["message"]
     
-    def test_list_analyses_basic(self, client, sample_data):
-        """Test GET /api/v1/analyses basic listing"""
-        response = client.get("/api/v1/analyses/?batch_id=1")
+    async def test_create_analyses_bulk(self, client, restore_sample_data):
+        """Test POST /api/v1/analyses/bulk skips duplicates"""
+        response = await client.post(URL_ANALYSES_BULK, content=_BULK_PAYLOAD_JSON, headers=_JSON_HEADERS)
+        assert response.status_code == 201
+        assert response.json() == {"inserted": 2, "skipped": 1}
+        
+        response = await client.get(URL_ANALYSES, params={"batch_id": 1, "isbn_list": "ISBN004,ISBN005"})
+        assert response.json()["total"] == 2
+    
+    @pytest.mark.parametrize("params, expected_total, expected_isbns", [
+        # Basic listing, default order ROI desc
+        ({"batch_id": 1}, 3, ["ISBN003", "ISBN001", "ISBN002"]),
+        # ROI filter: ISBN001 (45.5%) and ISBN003 (67.8%)
+        ({"batch_id": 1, "min_roi": 40.0}, 2, ["ISBN003", "ISBN001"]),
+        # Row exactly on the max bound is kept: ISBN001 (45.5%) and ISBN002 (32.1%)
+        ({"batch_id": 1, "max_roi": 45.5}, 2, ["ISBN001", "ISBN002"]),
+        ({"batch_id": 1, "profit_max": 12.45}, 1, ["ISBN002"]),
+        # ISBN list filtering
+        ({"batch_id": 1, "isbn_list": "ISBN001,ISBN003"}, 2, ["ISBN003", "ISBN001"]),
+        # Sorting by velocity_score desc: ISBN001 (72.3), ISBN002 (58.9), ISBN003 (41.2)
+        ({"batch_id": 1, "sort": "velocity_score", "sort_desc": "true"}, 3, ["ISBN001", "ISBN002", "ISBN003"]),
+    ])
+    async def test_list_analyses(self, client, sample_data, params, expected_total, expected_isbns):
+        """Test GET /api/v1/analyses listing, filters and sorting"""
+        response = await client.get(URL_ANALYSES, params=params)
         assert response.status_code == 200
         
         data = response.json()
-        assert data["total"] == 3
-        assert len(data["items"]) == 3
+        assert data["total"] == expected_total
+        assert [item["isbn_or_asin"] for item in data["items"]] == expected_isbns
         assert data["page"] == 1
         assert data["has_next"] == False
         assert data["has_prev"] == False
     
-    def test_list_analyses_with_filters(self, client, sample_data):
-        """Test GET /api/v1/analyses with ROI filter"""
-        response = client.get("/api/v1/analyses/?batch_id=1&min_roi=40.0")
-        assert response.status_code == 200
+    def test_threshold_params_bind_exact_decimals(self):
+        """Test float query thresholds become exact Decimals (asyncpg binds Decimal(value))"""
+        from backend.app.api.v1.routers.analyses import _threshold
         
-        data = response.json()
-        assert data["total"] == 2  # ISBN001 (45.5%) and ISBN003 (67.8%)
-        
-        # Verify all returned items have ROI >= 40
-        for item in data["items"]:
-            assert float(item["roi_percent"]) >= 40.0
+        assert _threshold(40.3) == Decimal("40.30")
+        assert _threshold(12.45) == Decimal("12.45")
     
-    def test_list_analyses_with_isbn_list(self, client, sample_data):
-        """Test ISBN list filtering"""
-        response = client.get("/api/v1/analyses/?batch_id=1&isbn_list=ISBN001,ISBN003")
+    async def test_list_analyses_cursor_pagination(self, client, sample_data):
+        """Test keyset pagination via next_cursor"""
+        response = await client.get(URL_ANALYSES, params={"batch_id": 1, "limit": 2})
         assert response.status_code == 200
         
-        data = response.json()
-        assert data["total"] == 2
+        first = response.json()
+        assert first["has_next"] == True
+        assert first["next_cursor"] is not None
         
-        isbns = {item["isbn_or_asin"] for item in data["items"]}
-        assert isbns == {"ISBN001", "ISBN003"}
-    
-    def test_list_analyses_with_sorting(self, client, sample_data):
-        """Test sorting by velocity_score desc"""
-        response = client.get("/api/v1/analyses/?batch_id=1&sort=velocity_score&sort_desc=true")
+        response = await client.get(URL_ANALYSES, params={"batch_id": 1, "limit": 2, "cursor": first["next_cursor"]})
         assert response.status_code == 200
         
-        data = response.json()
-        items = data["items"]
+        second = response.json()
+        # ROI desc: ISBN003 (67.8), ISBN001 (45.5) | ISBN002 (32.1)
+        assert [item["isbn_or_asin"] for item in first["items"]] == ["ISBN003", "ISBN001"]
+        assert [item["isbn_or_asin"] for item in second["items"]] == ["ISBN002"]
+        assert second["has_next"] == False
+        assert second["next_cursor"] is None
+        assert second["total"] is None
+
+    @pytest.mark.parametrize("params", [
+        {"sort": "bsr"},
+        {"sort_desc": "false"},
+    ])
+    async def test_list_analyses_cursor_rejects_other_sort(self, client, sample_data, params):
+        """Test a cursor reused with another sort field or direction is rejected"""
+        response = await client.get(URL_ANALYSES, params={"batch_id": 1, "limit": 2})
+        cursor = response.json()["next_cursor"]
+
+        response = await client.get(URL_ANALYSES, params={"batch_id": 1, "limit": 2, "cursor": cursor, **params})
+        assert response.status_code == 422
+        assert response.json()["detail"]["error"] == "invalid_cursor"
+
+    async def test_list_analyses_streamed_large_limit(self, client, sample_data):
+        """Test limit > 200 streams the same PageOut payload"""
+        response = await client.get(URL_ANALYSES, params={"batch_id": 1, "limit": 500})
+        assert response.status_code == 200
         
-        # Should be sorted: ISBN001 (72.3), ISBN002 (58.9), ISBN003 (41.2)
-        assert items[0]["isbn_or_asin"] == "ISBN001"
-        assert items[1]["isbn_or_asin"] == "ISBN002"
-        assert items[2]["isbn_or_asin"] == "ISBN003"
+        data = response.json()
+        assert data["total"] == 3
+        assert data["page_size"] == 500
+        assert data["has_next"] == False
+        assert data["next_cursor"] is None
+        assert [item["isbn_or_asin"] for item in data["items"]] == ["ISBN003", "ISBN001", "ISBN002"]
     
-    def test_list_analyses_invalid_sort_field(self, client, sample_data):
+    async def test_list_analyses_invalid_sort_field(self, client, sample_data):
         """Test invalid sort field error"""
-        response = client.get("/api/v1/analyses/?batch_id=1&sort=invalid_field")
+        response = await client.get(URL_ANALYSES, params={"batch_id": 1, "sort": "invalid_field"})
         assert response.status_code == 422
         
-        data = response.json()
+        data = response.json()["detail"]  # HTTPException body
         assert data["error"] == "invalid_sort_field"
         assert "invalid_field" in data["message"]
     
-    def test_get_top_analyses_balanced(self, client, sample_data):
-        """Test GET /api/v1/analyses/top with balanced strategy"""
-        response = client.get("/api/v1/analyses/top?batch_id=1&n=2&strategy=balanced")
+    @pytest.mark.parametrize("strategy", ["balanced", "roi"])
+    async def test_get_top_analyses(self, client, sample_data, strategy):
+        """Test GET /api/v1/analyses/top with balanced and ROI strategies"""
+        response = await client.get(URL_ANALYSES_TOP, params={"batch_id": 1, "n": 2, "strategy": strategy})
         assert response.status_code == 200
         
         data = response.json()
         assert len(data) == 2
         
-        # Based on balanced scoring (60% ROI + 40% velocity)
-        # ISBN003 should be first (67.8*0.6 + 41.2*0.4 = 57.16)
-        # ISBN001 should be second (45.5*0.6 + 72.3*0.4 = 56.22)
+        # ROI: ISBN003 (67.8%) first
+        # Balanced (60% ROI + 40% velocity): ISBN003 (67.8*0.6 + 41.2*0.4 = 57.16)
+        # ahead of ISBN001 (45.5*0.6 + 72.3*0.4 = 56.22)
         assert data[0]["isbn_or_asin"] == "ISBN003"
+        assert float(data[0]["roi_percent"]) == 67.8
     
-    def test_get_top_analyses_roi_strategy(self, client, sample_data):
-        """Test GET /api/v1/analyses/top with ROI strategy"""
-        response = client.get("/api/v1/analyses/top?batch_id=1&n=2&strategy=roi")
-        assert response.status_code == 200
+    async def test_get_top_analyses_cache_hit_matches_miss(self, client, sample_data, fake_cache):
+        """Test a cached top-N body is byte-identical to the uncached one (Decimals included)"""
+        params = {"batch_id": 1, "n": 2, "strategy": "roi"}
+        miss = await client.get(URL_ANALYSES_TOP, params=params)
+        assert miss.status_code == 200
+        assert topn_key(1, "roi", 2) in fake_cache.store
         
-        data = response.json()
-        assert len(data) == 2
+        hit = await client.get(URL_ANALYSES_TOP, params=params)
+        assert hit.status_code == 200
+        assert hit.content == miss.content
+    
+    async def test_get_top_analyses_cache_invalidated_on_insert(self, client, restore_sample_data, fake_cache):
+        """Test POST /api/v1/analyses drops the top-N keys tracked in the batch index set"""
+        params = {"batch_id": 1, "n": 5, "strategy": "roi"}
+        await client.get(URL_ANALYSES_TOP, params=params)
+        await client.get(URL_ANALYSES_TOP, params={**params, "strategy": "balanced"})
+        cached_keys = {topn_key(1, "roi", 5), topn_key(1, "balanced", 5)}
+        assert fake_cache.store[topn_index(1)] == cached_keys
         
-        # ROI strategy: ISBN003 (67.8%) should be first
-        assert data[0]["isbn_or_asin"] == "ISBN003"
-        assert float(data[0]["roi_percent"]) == 67.8
+        response = await client.post(URL_ANALYSES, content=_ANALYSIS_PAYLOAD_JSON, headers=_JSON_HEADERS)
+        assert response.status_code == 201
+        assert not (cached_keys | {topn_index(1)}) & fake_cache.store.keys()
+        
+        # Fresh top-N includes the new ISBN004 (55.5%) between ISBN003 and ISBN001
+        response = await client.get(URL_ANALYSES_TOP, params=params)
+        assert [item["isbn_or_asin"] for item in response.json()] == ["ISBN003", "ISBN004", "ISBN001", "ISBN002"]
     
-    def test_get_top_analyses_batch_not_found(self, client, sample_data):
+    async def test_get_top_analyses_batch_not_found(self, client, sample_data):
         """Test top analyses with non-existent batch"""
-        response = client.get("/api/v1/analyses/top?batch_id=999&strategy=roi")
+        response = await client.get(URL_ANALYSES_TOP, params={"batch_id": 999, "strategy": "roi"})
         assert response.status_code == 404
         
-        data = response.json()
+        data = response.json()["detail"]  # HTTPException body
         assert data["error"] == "not_found"
         assert "999" in data["message"]
 
 class TestBatchEndpoints:
     """Test batch endpoints"""
     
-    def test_list_batches(self, client, sample_data):
+    async def test_list_batches(self, client, sample_data):
         """Test GET /api/v1/batches"""
-        response = client.get("/api/v1/batches/")
+        response = await client.get(URL_BATCHES)
         assert response.status_code == 200
         
         data = response.json()
@@ -282,10 +569,27 @@ class TestBatchEndpoints:
         assert batch["items_processed"] == 1
         assert batch["progress_percent"] == 33.3
         assert batch["items_remaining"] == 2
-    
-    def test_get_batch_stats(self, client, sample_data):
+        assert batch["strategy_snapshot"] is None  # Detail endpoint only
+
+    async def test_list_batches_items_total_from_analyses(self, client, class_db_session, restore_sample_data):
+        """Test items_total falls back to the analysis count while unset (read-only)"""
+        _seed_unsized_batch(class_db_session)
+
+        response = await client.get(URL_BATCHES)
+        assert response.status_code == 200
+
+        batch = next(item for item in response.json() if item["id"] == 2)
+        assert batch["items_total"] == 2
+        assert batch["progress_percent"] == 50.0
+        assert batch["items_remaining"] == 1
+
+        # Nothing persisted by the GET
+        class_db_session.expire_all()
+        assert class_db_session.get(Batch, 2).items_total == 0
+
+    async def test_get_batch_stats(self, client, sample_data):
         """Test GET /api/v1/batches/stats"""
-        response = client.get("/api/v1/batches/stats")
+        response = await client.get(URL_BATCHES_STATS)
         assert response.status_code == 200
         
         data = response.json()
@@ -296,37 +600,68 @@ class TestBatchEndpoints:
         assert "batches_by_status" in data
         assert data["batches_by_status"]["RUNNING"] == 1
     
-    def test_update_batch_status_valid_transition(self, client, sample_data):
+    async def test_update_batch_status_valid_transition(self, client, restore_sample_data):
         """Test PATCH /api/v1/batches/{id}/status valid transition"""
-        update_data = {
-            "status": "DONE",
-            "items_processed": 3
-        }
-        
-        response = client.patch("/api/v1/batches/1/status", json=update_data)
+        response = await client.patch(URL_BATCH_STATUS, content=_STATUS_DONE_JSON, headers=_JSON_HEADERS)
         assert response.status_code == 200
         
         data = response.json()
         assert data["status"] == "DONE"
         assert data["items_processed"] == 3
         assert data["progress_percent"] == 100.0
-        assert data["finished_at"] is not None
+        assert data["finished_at"].startswith("2024-01-01T00:00:00")
     
-    def test_update_batch_status_invalid_transition(self, client, sample_data):
-        """Test invalid status transition"""
-        update_data = {"status": "PENDING"}  # RUNNING -> PENDING not allowed
+    async def test_update_batch_status_done_bounds_items_processed_by_backfill(
+        self, client, class_db_session, restore_sample_data
+    ):
+        """Test items_processed is checked against the items_total backfilled on DONE"""
+        _seed_unsized_batch(class_db_session)
         
-        response = client.patch("/api/v1/batches/1/status", json=update_data)
+        body = json.dumps({"status": "DONE", "items_processed": 10}).encode()
+        response = await client.patch("/api/v1/batches/2/status", content=body, headers=_JSON_HEADERS)
         assert response.status_code == 422
+        assert "items_total (2)" in response.json()["detail"]["message"]
+        
+        body = json.dumps({"status": "DONE", "items_processed": 2}).encode()
+        response = await client.patch("/api/v1/batches/2/status", content=body, headers=_JSON_HEADERS)
+        assert response.status_code == 200
         
         data = response.json()
+        assert data["items_total"] == 2
+        assert data["progress_percent"] == 100.0
+    
+    async def test_update_batch_status_failed_restart_keeps_items_total_unset(
+        self, client, class_db_session, restore_sample_data
+    ):
+        """Test FAILED does not persist the backfilled items_total (restart stays unsized)"""
+        _seed_unsized_batch(class_db_session)
+        url = "/api/v1/batches/2/status"
+        
+        for body in ({"status": "FAILED"}, {"status": "PENDING"}):
+            response = await client.patch(url, content=json.dumps(body).encode(), headers=_JSON_HEADERS)
+            assert response.status_code == 200
+        assert response.json()["items_total"] == 0
+        
+        # More items than the 2 analyses counted before the failure
+        body = json.dumps({"status": "RUNNING", "items_processed": 5}).encode()
+        response = await client.patch(url, content=body, headers=_JSON_HEADERS)
+        assert response.status_code == 200
+        assert response.json()["items_processed"] == 5
+    
+    async def test_update_batch_status_invalid_transition(self, client, sample_data):
+        """Test invalid status transition"""
+        # RUNNING -> PENDING not allowed
+        response = await client.patch(URL_BATCH_STATUS, content=_STATUS_PENDING_JSON, headers=_JSON_HEADERS)
+        assert response.status_code == 422
+        
+        data = response.json()["detail"]  # HTTPException body
         assert data["error"] == "invalid_status_transition"
         assert "RUNNING" in data["message"]
         assert "PENDING" in data["message"]
     
-    def test_get_batch_by_id(self, client, sample_data):
+    async def test_get_batch_by_id(self, client, sample_data):
         """Test GET /api/v1/batches/{id}"""
-        response = client.get("/api/v1/batches/1")
+        response = await client.get(URL_BATCH)
         assert response.status_code == 200
         
         data = response.json()
@@ -334,21 +669,56 @@ class TestBatchEndpoints:
         assert data["name"] == "Test Batch"
         assert data["status"] == "RUNNING"
     
-    def test_get_batch_not_found(self, client, sample_data):
+    async def test_get_batch_cache_hit_matches_miss(self, client, sample_data, fake_cache):
+        """Test a cached GET /api/v1/batches/{id} and /stats return the uncached payload"""
+        for url, key in [(URL_BATCH, batch_key(1)), (URL_BATCHES_STATS, STATS_KEY)]:
+            miss = await client.get(url)
+            assert miss.status_code == 200
+            assert key in fake_cache.store
+            
+            hit = await client.get(url)
+            assert hit.status_code == 200
+            assert hit.content == miss.content
+    
+    async def test_batch_cache_invalidated_on_status_update(self, client, restore_sample_data, fake_cache):
+        """Test PATCH /api/v1/batches/{id}/status drops the batch and stats keys"""
+        await client.get(URL_BATCH)
+        await client.get(URL_BATCHES_STATS)
+        assert {batch_key(1), STATS_KEY} <= fake_cache.store.keys()
+        
+        response = await client.patch(URL_BATCH_STATUS, content=_STATUS_DONE_JSON, headers=_JSON_HEADERS)
+        assert response.status_code == 200
+        assert batch_key(1) not in fake_cache.store
+        assert STATS_KEY not in fake_cache.store
+        
+        response = await client.get(URL_BATCH)
+        assert response.json()["status"] == "DONE"
+    
+    async def test_get_batch_not_found(self, client, sample_data):
         """Test batch not found"""
-        response = client.get("/api/v1/batches/999")
+        response = await client.get(URL_BATCH_MISSING)
         assert response.status_code == 404
         
-        data = response.json()
+        data = response.json()["detail"]  # HTTPException body
         assert data["error"] == "not_found"
         assert "999" in data["message"]
 
+class TestResponseCache:
+    """Test ResponseCache serialization"""
+    
+    async def test_decimal_round_trip_keeps_json_mode(self):
+        """Test cached Decimals come back as pydantic JSON strings, not floats"""
+        cache = ResponseCache(_FakeRedis())
+        await cache.set("key", {"price": Decimal("45.50"), "roi": Decimal("0.10")}, ttl=60)
+        
+        assert await cache.get("key") == {"price": "45.50", "roi": "0.10"}
+
 class TestRootEndpoint:
     """Test root endpoint"""
     
-    def test_root_endpoint(self, client):
+    async def test_root_endpoint(self, client):
         """Test GET / root endpoint"""
-        response = client.get("/")
+        response = await client.get(URL_ROOT)
         assert response.status_code == 200
         
         data = response.json()
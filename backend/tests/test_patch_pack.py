@@ -1,34 +1,77 @@
 import pytest
 from decimal import Decimal
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from functools import lru_cache
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
 from sqlalchemy.exc import IntegrityError
 
-# Import models and repositories - ✅ FIX: Correct paths
-import sys
-import os
-sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-
+# Import models and repositories (backend/ est sur le pythonpath via pytest.ini)
 from app.models.analysis import Analysis, Base
 from app.models.batch import Batch
 from app.repositories.analysis import AnalysisRepository
+from app.core.exceptions import NotFoundError
 from app.repositories.base import (
     FilterCriteria, FilterCondition, DuplicateIsbnInBatchError, 
     InvalidSortFieldError, InvalidFilterFieldError
 )
 
-@pytest.fixture
-def db_session():
-    """Create in-memory SQLite session for testing"""
-    engine = create_engine("sqlite:///:memory:", echo=False)
-    Base.metadata.create_all(engine)
+# Résultats attendus pré-construits (comparaison d'ensembles en une assertion)
+ISBNS_001_002 = frozenset({"ISBN001", "ISBN002"})
+ISBNS_001_003 = frozenset({"ISBN001", "ISBN003"})
+
+# Decimal parsé une seule fois par littéral (les mêmes valeurs reviennent d'un test à l'autre)
+D = lru_cache(maxsize=None)(Decimal)
+
+@pytest.fixture(scope="session")
+def engine():
+    """In-memory SQLite engine, schema created once for the whole session
+    
+    StaticPool keeps a single connection (hence a single in-memory database)
+    alive for every test, whatever thread checks it out.
+    """
+    engine = create_engine(
+        "sqlite://",
+        echo=False,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool
+    )
     
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    session.expire_on_commit = False  # Important pour tests
+    # pysqlite: laisser SQLAlchemy émettre BEGIN lui-même pour que les
+    # SAVEPOINT (begin_nested) fonctionnent
+    @event.listens_for(engine, "connect")
+    def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+    
+    @event.listens_for(engine, "begin")
+    def _emit_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+    
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def db_session(engine):
+    """Session joined to an external transaction, rolled back after each test
+    
+    commit()/rollback() inside the test (and in the repository) only end a
+    SAVEPOINT, so no test leaves rows behind and no DDL runs per test.
+    """
+    connection = engine.connect()
+    trans = connection.begin()
+    session = Session(
+        bind=connection,
+        autoflush=False,  # Flush explicite (commit/flush) avant les lectures
+        expire_on_commit=False,  # Important pour tests
+        join_transaction_mode="create_savepoint"
+    )
     
     yield session
+    
     session.close()
+    trans.rollback()
+    connection.close()
 
 @pytest.fixture
 def sample_batch(db_session):
@@ -52,14 +95,13 @@ def test_patch1_isbn_list_filtering(analysis_repo, sample_batch, db_session):  #
     
     # Create test data with different ISBNs
     analyses = [
-        Analysis(batch_id=1, isbn_or_asin="ISBN001", roi_percent=Decimal("25.5")),
-        Analysis(batch_id=1, isbn_or_asin="ISBN002", roi_percent=Decimal("35.2")),
-        Analysis(batch_id=1, isbn_or_asin="ISBN003", roi_percent=Decimal("45.8")),
-        Analysis(batch_id=1, isbn_or_asin="ISBN004", roi_percent=Decimal("15.1"))
+        Analysis(batch_id=1, isbn_or_asin="ISBN001", roi_percent=D("25.5")),
+        Analysis(batch_id=1, isbn_or_asin="ISBN002", roi_percent=D("35.2")),
+        Analysis(batch_id=1, isbn_or_asin="ISBN003", roi_percent=D("45.8")),
+        Analysis(batch_id=1, isbn_or_asin="ISBN004", roi_percent=D("15.1"))
     ]
     
-    for analysis in analyses:
-        db_session.add(analysis)
+    db_session.bulk_save_objects(analyses)  # Un seul executemany INSERT
     db_session.commit()
     
     # Test filtering by specific ISBN list
@@ -69,14 +111,13 @@ def test_patch1_isbn_list_filtering(analysis_repo, sample_batch, db_session):  #
     )
     
     assert result.total == 2
-    returned_isbns = {item.isbn_or_asin for item in result.items}
-    assert returned_isbns == {"ISBN001", "ISBN003"}
+    assert {item.isbn_or_asin for item in result.items} == ISBNS_001_003
 
 def test_patch1_isbn_list_normalization(analysis_repo, sample_batch, db_session):  # ✅ FIX: Remove async
     """Test ISBN normalization in list_filtered"""
     
     # Create analysis with normalized ISBN
-    analysis = Analysis(batch_id=1, isbn_or_asin="ISBN001", roi_percent=Decimal("25.5"))
+    analysis = Analysis(batch_id=1, isbn_or_asin="ISBN001", roi_percent=D("25.5"))
     db_session.add(analysis)
     db_session.commit()
     
@@ -93,17 +134,16 @@ def test_patch1_isbn_list_with_other_filters(analysis_repo, sample_batch, db_ses
     """Test isbn_list combined with other filters"""
     
     analyses = [
-        Analysis(batch_id=1, isbn_or_asin="ISBN001", roi_percent=Decimal("25.5")),
-        Analysis(batch_id=1, isbn_or_asin="ISBN002", roi_percent=Decimal("35.2")),
-        Analysis(batch_id=1, isbn_or_asin="ISBN003", roi_percent=Decimal("5.8"))  # Low ROI
+        Analysis(batch_id=1, isbn_or_asin="ISBN001", roi_percent=D("25.5")),
+        Analysis(batch_id=1, isbn_or_asin="ISBN002", roi_percent=D("35.2")),
+        Analysis(batch_id=1, isbn_or_asin="ISBN003", roi_percent=D("5.8"))  # Low ROI
     ]
     
-    for analysis in analyses:
-        db_session.add(analysis)
+    db_session.bulk_save_objects(analyses)  # Un seul executemany INSERT
     db_session.commit()
     
     # Combine ISBN list + ROI filter
-    filters = [FilterCriteria(field="roi_percent", condition=FilterCondition.GTE, value=Decimal("20"))]
+    filters = [FilterCriteria(field="roi_percent", condition=FilterCondition.GTE, value=D("20"))]
     
     result = analysis_repo.list_filtered(  # ✅ FIX: Remove await
         batch_id=1,
@@ -112,8 +152,7 @@ def test_patch1_isbn_list_with_other_filters(analysis_repo, sample_batch, db_ses
     )
     
     assert result.total == 2  # Only ISBN001 and ISBN002 have ROI >= 20
-    returned_isbns = {item.isbn_or_asin for item in result.items}
-    assert returned_isbns == {"ISBN001", "ISBN002"}
+    assert {item.isbn_or_asin for item in result.items} == ISBNS_001_002
 
 # ============================================================================
 # PATCH 2 TESTS: Strict sort field validation
@@ -123,12 +162,11 @@ def test_patch2_valid_sort_field(analysis_repo, sample_batch, db_session):  # 
     """Test sorting with valid field"""
     
     analyses = [
-        Analysis(batch_id=1, isbn_or_asin="ISBN001", roi_percent=Decimal("15.5")),
-        Analysis(batch_id=1, isbn_or_asin="ISBN002", roi_percent=Decimal("25.2"))
+        Analysis(batch_id=1, isbn_or_asin="ISBN001", roi_percent=D("15.5")),
+        Analysis(batch_id=1, isbn_or_asin="ISBN002", roi_percent=D("25.2"))
     ]
     
-    for analysis in analyses:
-        db_session.add(analysis)
+    db_session.bulk_save_objects(analyses)  # Un seul executemany INSERT
     db_session.commit()
     
     # Test valid sort field
@@ -144,7 +182,7 @@ def test_patch2_valid_sort_field(analysis_repo, sample_batch, db_session):  # 
 def test_patch2_invalid_sort_field_raises_error(analysis_repo, sample_batch, db_session):  # ✅ FIX: Remove async
     """Test that invalid sort field raises InvalidSortFieldError"""
     
-    analysis = Analysis(batch_id=1, isbn_or_asin="ISBN001", roi_percent=Decimal("15.5"))
+    analysis = Analysis(batch_id=1, isbn_or_asin="ISBN001", roi_percent=D("15.5"))
     db_session.add(analysis)
     db_session.commit()
     
@@ -158,6 +196,64 @@ def test_patch2_invalid_sort_field_raises_error(analysis_repo, sample_batch, db_
     assert "invalid_field is not sortable" in str(exc_info.value)
     assert "roi_percent" in str(exc_info.value)  # Should show allowed fields
 
+def test_list_filtered_after_cursor_pagination(analysis_repo, sample_batch, db_session):
+    """Test keyset pagination walks all rows once, NULL sort values last"""
+    
+    analyses = [
+        Analysis(batch_id=1, isbn_or_asin="ISBN001", roi_percent=D("25.5")),
+        Analysis(batch_id=1, isbn_or_asin="ISBN002", roi_percent=D("35.2")),
+        Analysis(batch_id=1, isbn_or_asin="ISBN003", roi_percent=D("35.2")),
+        Analysis(batch_id=1, isbn_or_asin="ISBN004", roi_percent=None),
+        Analysis(batch_id=1, isbn_or_asin="ISBN005", roi_percent=None)
+    ]
+    
+    db_session.bulk_save_objects(analyses)  # Un seul executemany INSERT
+    db_session.commit()
+    
+    seen = []
+    after = None
+    while True:
+        page = analysis_repo.list_filtered(
+            batch_id=1,
+            sort_by="roi_percent",
+            sort_desc=True,
+            after=after,
+            page_size=2
+        )
+        seen.extend(item.isbn_or_asin for item in page.items)
+        if not page.has_next:
+            break
+        after = page.next_after
+    
+    assert page.total is None  # Keyset pages: no COUNT
+    assert seen == ["ISBN003", "ISBN002", "ISBN001", "ISBN005", "ISBN004"]
+
+def test_list_filtered_continues_with_after_cursor(analysis_repo, sample_batch, db_session):
+    """Test list_filtered(after=...) resumes from an offset page's next_after"""
+    
+    for i, roi in enumerate(["10.0", "30.0", "20.0"], start=1):
+        db_session.add(Analysis(batch_id=1, isbn_or_asin=f"ISBN00{i}", roi_percent=D(roi)))
+    db_session.commit()
+    
+    first = analysis_repo.list_filtered(batch_id=1, sort_by="roi_percent", sort_desc=True, page_size=2)
+    assert [a.isbn_or_asin for a in first.items] == ["ISBN002", "ISBN003"]
+    assert first.next_after == (D("20.0"), first.items[-1].id)
+    
+    second = analysis_repo.list_filtered(
+        batch_id=1, sort_by="roi_percent", sort_desc=True, page_size=2, after=first.next_after
+    )
+    assert [a.isbn_or_asin for a in second.items] == ["ISBN001"]
+    assert second.total is None
+    assert second.next_after is None
+
+def test_assert_batch_exists(analysis_repo, sample_batch):
+    """Test existence check passes for known batch, raises NotFoundError otherwise"""
+    
+    analysis_repo.assert_batch_exists(sample_batch.id)
+    
+    with pytest.raises(NotFoundError):
+        analysis_repo.assert_batch_exists(999)
+
 # ============================================================================
 # PATCH 3 TESTS: Balanced strategy with Decimal precision
 # ============================================================================
@@ -169,37 +265,33 @@ def test_patch3_balanced_strategy_decimal_precision(analysis_repo, sample_batch,
         Analysis(
             batch_id=1, 
             isbn_or_asin="ISBN001", 
-            roi_percent=Decimal("40.0"),    # High ROI
-            velocity_score=Decimal("20.0")   # Low velocity
+            roi_percent=D("40.0"),    # High ROI
+            velocity_score=D("20.0")   # Low velocity
         ),
         Analysis(
             batch_id=1, 
             isbn_or_asin="ISBN002", 
-            roi_percent=Decimal("20.0"),    # Low ROI
-            velocity_score=Decimal("60.0")   # High velocity
+            roi_percent=D("20.0"),    # Low ROI
+            velocity_score=D("60.0")   # High velocity
         )
     ]
     
-    for analysis in analyses:
-        db_session.add(analysis)
+    db_session.bulk_save_objects(analyses)  # Un seul executemany INSERT
     db_session.commit()
     
-    # Test balanced strategy
-    result = analysis_repo.top_n_for_batch(  # ✅ FIX: Remove await
+    # Test balanced strategy (ranking only: ISBNs, no ORM rows)
+    result = analysis_repo.top_n_isbns(
         batch_id=1,
         strategy="balanced",
         limit=2
     )
     
-    assert len(result) == 2
-    
     # Calculate expected balanced scores
     # ISBN001: 40 * 0.6 + 20 * 0.4 = 24 + 8 = 32
     # ISBN002: 20 * 0.6 + 60 * 0.4 = 12 + 24 = 36
     
     # ISBN002 should be first (higher balanced score)
-    assert result[0].isbn_or_asin == "ISBN002"
-    assert result[1].isbn_or_asin == "ISBN001"
+    assert result == ["ISBN002", "ISBN001"]
 
 # ============================================================================
 # PATCH 4 TESTS: IntegrityError handling
@@ -212,7 +304,7 @@ def test_patch4_duplicate_isbn_in_batch_error(analysis_repo, sample_batch, db_se
     analysis1 = analysis_repo.create_analysis(  # ✅ FIX: Remove await
         batch_id=1,
         isbn_or_asin="ISBN001",
-        roi_percent=Decimal("25.5")
+        roi_percent=D("25.5")
     )
     db_session.commit()
     
@@ -223,12 +315,30 @@ def test_patch4_duplicate_isbn_in_batch_error(analysis_repo, sample_batch, db_se
         analysis_repo.create_analysis(  # ✅ FIX: Remove await
             batch_id=1,
             isbn_or_asin="ISBN001",  # Same ISBN, same batch
-            roi_percent=Decimal("35.2")
+            roi_percent=D("35.2")
         )
     
     assert "ISBN001" in str(exc_info.value)
     assert "batch 1" in str(exc_info.value)
 
+def test_upsert_returning_detects_duplicate(analysis_repo, sample_batch, db_session):
+    """Test INSERT ... ON CONFLICT DO NOTHING RETURNING path"""
+    
+    analysis = analysis_repo.upsert_returning(
+        batch_id=1,
+        isbn_or_asin=" isbn001 ",
+        roi_percent=D("25.5")
+    )
+    db_session.commit()
+    
+    assert analysis.id is not None
+    assert analysis.isbn_or_asin == "ISBN001"
+    
+    with pytest.raises(DuplicateIsbnInBatchError) as exc_info:
+        analysis_repo.upsert_returning(batch_id=1, isbn_or_asin="ISBN001")
+    
+    assert "batch 1" in str(exc_info.value)
+
 def test_patch4_same_isbn_different_batch_allowed(analysis_repo, db_session):  # ✅ FIX: Remove async
     """Test same ISBN allowed in different batches"""
     
@@ -243,13 +353,13 @@ def test_patch4_same_isbn_different_batch_allowed(analysis_repo, db_session):  #
     analysis1 = analysis_repo.create_analysis(  # ✅ FIX: Remove await
         batch_id=1,
         isbn_or_asin="ISBN001",
-        roi_percent=Decimal("25.5")
+        roi_percent=D("25.5")
     )
     
     analysis2 = analysis_repo.create_analysis(  # ✅ FIX: Remove await
         batch_id=2,
         isbn_or_asin="ISBN001",  # Same ISBN, different batch
-        roi_percent=Decimal("35.2")
+        roi_percent=D("35.2")
     )
     
     db_session.commit()
@@ -264,7 +374,7 @@ def test_patch4_isbn_normalization_in_create(analysis_repo, sample_batch, db_ses
     analysis = analysis_repo.create_analysis(  # ✅ FIX: Remove await
         batch_id=1,
         isbn_or_asin=" isbn001 ",  # Lowercase with spaces
-        roi_percent=Decimal("25.5")
+        roi_percent=D("25.5")
     )
     db_session.commit()
     
@@ -277,26 +387,18 @@ def test_patch4_isbn_normalization_in_create(analysis_repo, sample_batch, db_ses
 def test_all_patches_integration(analysis_repo, sample_batch, db_session):  # ✅ FIX: Remove async
     """Test all patches working together"""
     
-    # Create diverse test data
-    analyses_data = [
-        {"isbn": "ISBN001", "roi": Decimal("40.0"), "velocity": Decimal("30.0"), "profit": Decimal("15.50")},
-        {"isbn": "ISBN002", "roi": Decimal("25.0"), "velocity": Decimal("70.0"), "profit": Decimal("12.25")},
-        {"isbn": "ISBN003", "roi": Decimal("60.0"), "velocity": Decimal("20.0"), "profit": Decimal("18.75")},
-        {"isbn": "ISBN004", "roi": Decimal("15.0"), "velocity": Decimal("40.0"), "profit": Decimal("8.30")}
-    ]
-    
-    for data in analyses_data:
-        analysis = analysis_repo.create_analysis(  # ✅ FIX: Remove await
-            batch_id=1,
-            isbn_or_asin=data["isbn"],
-            roi_percent=data["roi"],
-            velocity_score=data["velocity"],
-            profit=data["profit"]
-        )
+    # Create diverse test data (one executemany INSERT, create_analysis is
+    # only exercised on the duplicate below)
+    db_session.execute(insert(Analysis), [
+        dict(batch_id=1, isbn_or_asin="ISBN001", roi_percent=D("40.0"), velocity_score=D("30.0"), profit=D("15.50")),
+        dict(batch_id=1, isbn_or_asin="ISBN002", roi_percent=D("25.0"), velocity_score=D("70.0"), profit=D("12.25")),
+        dict(batch_id=1, isbn_or_asin="ISBN003", roi_percent=D("60.0"), velocity_score=D("20.0"), profit=D("18.75")),
+        dict(batch_id=1, isbn_or_asin="ISBN004", roi_percent=D("15.0"), velocity_score=D("40.0"), profit=D("8.30"))
+    ])
     db_session.commit()
     
     # ✅ PATCH 1: Test isbn_list filtering + other filters
-    roi_filter = FilterCriteria(field="roi_percent", condition=FilterCondition.GTE, value=Decimal("30"))
+    roi_filter = FilterCriteria(field="roi_percent", condition=FilterCondition.GTE, value=D("30"))
     
     result = analysis_repo.list_filtered(  # ✅ FIX: Remove await
         batch_id=1,
@@ -325,6 +427,11 @@ def test_all_patches_integration(analysis_repo, sample_batch, db_session):  # 
             batch_id=1,
             isbn_or_asin="ISBN001"  # Duplicate
         )
+    
+    # Seeded rows untouched by the rejected duplicate
+    seeded = analysis_repo.list_filtered(batch_id=1, isbn_list=["ISBN001"])
+    assert seeded.total == 1
+    assert seeded.items[0].roi_percent == D("40.0")
 
 # ============================================================================
 # MINI-CONTROLE VALIDATION TESTS
@@ -370,8 +477,8 @@ def test_mini_controle_decimal_in_balanced_strategy(analysis_repo, sample_batch,
     analysis = Analysis(
         batch_id=1,
         isbn_or_asin="ISBN001", 
-        roi_percent=Decimal("33.33"),
-        velocity_score=Decimal("66.67")
+        roi_percent=D("33.33"),
+        velocity_score=D("66.67")
     )
     db_session.add(analysis)
     db_session.commit()
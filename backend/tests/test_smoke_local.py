@@ -1,16 +1,89 @@
+import contextlib
 import pytest
 from decimal import Decimal
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import Session, raiseload, sessionmaker
+from sqlalchemy.pool import StaticPool
 
 # Import models and repositories with corrected paths
 from backend.app.models import Base, User, UserRole, Batch, BatchStatus, Analysis
 from backend.app.repositories.analysis import AnalysisRepository
 
+# Résultats attendus pré-construits (comparaison d'ensembles en une assertion)
+ISBNS_001_002 = frozenset({"ISBN001", "ISBN002"})
+ISBNS_001_003 = frozenset({"ISBN001", "ISBN003"})
+ISBNS_002_003 = frozenset({"ISBN002", "ISBN003"})
+
+# Jeu de données du smoke test, construit une fois à l'import
+# (isbn, title, roi, velocity, profit, price, bsr)
+_ANALYSES_DATA = (
+    ("ISBN001", "Advanced Python Programming", Decimal("45.5"), Decimal("72.3"), Decimal("18.75"), Decimal("35.99"), 15420),
+    ("ISBN002", "Data Structures & Algorithms", Decimal("32.1"), Decimal("58.9"), Decimal("12.45"), Decimal("42.50"), 28750),
+    ("ISBN003", "Machine Learning Fundamentals", Decimal("67.8"), Decimal("41.2"), Decimal("25.30"), Decimal("29.99"), 8950),
+)
+
+# Seuils partagés (filtre ROI et count_by_thresholds)
+ROI_THRESHOLD = Decimal("40.0")
+VELOCITY_THRESHOLD = Decimal("60.0")
+PROFIT_THRESHOLD = Decimal("15.0")
+
+@contextlib.contextmanager
+def count_queries(conn):
+    """Collect the SQL statements emitted on conn inside the block
+    
+    SAVEPOINT / RELEASE issued by the test transaction fixture are not
+    counted: only the repository's own queries are.
+    """
+    queries = []
+    
+    def hook(conn, cursor, statement, parameters, context, executemany):
+        if not statement.startswith(("SAVEPOINT", "RELEASE", "ROLLBACK")):
+            queries.append(statement)
+    
+    event.listen(conn, "before_cursor_execute", hook)
+    try:
+        yield queries
+    finally:
+        event.remove(conn, "before_cursor_execute", hook)
+
+def explain_query_plan(conn, call):
+    """EXPLAIN QUERY PLAN of the last statement emitted on conn by call()"""
+    captured = []
+    
+    def hook(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+    
+    event.listen(conn, "before_cursor_execute", hook)
+    try:
+        call()
+    finally:
+        event.remove(conn, "before_cursor_execute", hook)
+    
+    statement, parameters = captured[-1]
+    plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+    return " | ".join(row[-1] for row in plan)
+
 @pytest.fixture(scope="session")
 def engine():
-    """Create test database engine"""
-    engine = create_engine("sqlite:///:memory:", echo=False)
+    """Create test database engine (schema created once per session)"""
+    # Engine de session : son cache de requêtes compilées (LRU par défaut en
+    # 2.x) reste chaud d'un test à l'autre
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool  # One connection = one in-memory database
+    )
+    
+    # pysqlite: laisser SQLAlchemy émettre BEGIN lui-même pour que les
+    # SAVEPOINT fonctionnent
+    @event.listens_for(engine, "connect")
+    def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+    
+    @event.listens_for(engine, "begin")
+    def _emit_begin(conn):
+        conn.exec_driver_sql("BEGIN")
     
     # Create all tables from shared Base
     Base.metadata.create_all(engine)
@@ -18,16 +91,46 @@ def engine():
     yield engine
     engine.dispose()
 
+@pytest.fixture(scope="session")
+def session_factory(engine):
+    """sessionmaker built once per session; db_session binds it per test"""
+    return sessionmaker(
+        class_=Session,
+        expire_on_commit=False,
+        join_transaction_mode="create_savepoint"
+    )
+
 @pytest.fixture
-def db_session(engine):
-    """Create database session for each test"""
-    Session = sessionmaker(bind=engine, expire_on_commit=False)
-    session = Session()
+def db_session(engine, session_factory):
+    """Session joined to an external transaction, rolled back after each test
+    
+    commit() in the test only releases a SAVEPOINT: nothing is persisted
+    across tests.
+    """
+    connection = engine.connect()
+    transaction = connection.begin()
+    session = session_factory(bind=connection)
     
     yield session
     
-    session.rollback()
     session.close()
+    transaction.rollback()
+    connection.close()
+
+@pytest.fixture
+def batch_with_one_analysis(db_session):
+    """Batch + analyse TESTISBN001, flushés dans la transaction du test (aucun commit)"""
+    batch = Batch(name="Duplicate Test", status=BatchStatus.RUNNING)
+    db_session.add(batch)
+    db_session.flush()
+    
+    analysis_repo = AnalysisRepository(db_session)
+    analysis_repo.create_analysis(
+        batch_id=batch.id,
+        isbn_or_asin="TESTISBN001",
+        roi_percent=Decimal("25.0")
+    )
+    return batch, analysis_repo
 
 class TestSmokeLocal:
     """✅ Smoke test: création user → batch → 3 analyses → list/filter/delete"""
@@ -42,7 +145,7 @@ class TestSmokeLocal:
             role=UserRole.SOURCER
         )
         db_session.add(user)
-        db_session.commit()
+        db_session.flush()
         
         assert user.id is not None
         assert user.email == "testuser@arbitragevault.com"
@@ -55,7 +158,7 @@ class TestSmokeLocal:
             items_processed=0
         )
         db_session.add(batch)
-        db_session.commit()
+        db_session.flush()
         
         assert batch.id is not None
         assert batch.status == BatchStatus.RUNNING
@@ -63,64 +166,37 @@ class TestSmokeLocal:
         # ✅ STEP 3: Créer repository et 3 analyses
         analysis_repo = AnalysisRepository(db_session)
         
-        analyses_data = [
-            {
-                "isbn": "ISBN001",
-                "title": "Advanced Python Programming",
-                "roi": Decimal("45.5"),
-                "velocity": Decimal("72.3"),
-                "profit": Decimal("18.75"),
-                "price": Decimal("35.99"),
-                "bsr": 15420
-            },
+        # Un seul INSERT executemany (le repository est couvert par les étapes suivantes)
+        db_session.execute(insert(Analysis), [
             {
-                "isbn": "ISBN002", 
-                "title": "Data Structures & Algorithms",
-                "roi": Decimal("32.1"),
-                "velocity": Decimal("58.9"),
-                "profit": Decimal("12.45"),
-                "price": Decimal("42.50"),
-                "bsr": 28750
-            },
-            {
-                "isbn": "ISBN003",
-                "title": "Machine Learning Fundamentals", 
-                "roi": Decimal("67.8"),
-                "velocity": Decimal("41.2"),
-                "profit": Decimal("25.30"),
-                "price": Decimal("29.99"),
-                "bsr": 8950
+                "batch_id": batch.id,
+                "isbn_or_asin": isbn,
+                "title": title,
+                "roi_percent": roi,
+                "velocity_score": velocity,
+                "profit": profit,
+                "current_price": price,
+                "bsr": bsr
             }
-        ]
+            for isbn, title, roi, velocity, profit, price, bsr in _ANALYSES_DATA
+        ])
         
-        created_analyses = []
-        for data in analyses_data:
-            analysis = analysis_repo.create_analysis(
-                batch_id=batch.id,
-                isbn_or_asin=data["isbn"],
-                title=data["title"],
-                roi_percent=data["roi"],
-                velocity_score=data["velocity"],
-                profit=data["profit"],
-                current_price=data["price"],
-                bsr=data["bsr"]
-            )
-            created_analyses.append(analysis)
-        
-        db_session.commit()
+        created_analyses = db_session.scalars(
+            select(Analysis).where(Analysis.batch_id == batch.id).order_by(Analysis.id)
+        ).all()
         
         # Vérifier création
         assert len(created_analyses) == 3
-        for analysis in created_analyses:
-            assert analysis.id is not None
-            assert analysis.batch_id == batch.id
+        assert all(a.id is not None and a.batch_id == batch.id for a in created_analyses)
         
-        # ✅ STEP 4: Test list_filtered (base)
-        page = analysis_repo.list_filtered(
-            batch_id=batch.id,
-            page=1,
-            page_size=10
-        )
+        # ✅ STEP 4: Test list_filtered (base) - COUNT + page SELECT, pas de N+1
+        with count_queries(db_session.connection()) as queries:
+            page = analysis_repo.list_filtered(
+                batch_id=batch.id,
+                page=1,
+                page_size=10
+            )
+        assert len(queries) <= 2
         
         assert page.total == 3
         assert len(page.items) == 3
@@ -134,7 +210,7 @@ class TestSmokeLocal:
         roi_filter = FilterCriteria(
             field="roi_percent",
             condition=FilterCondition.GTE,
-            value=Decimal("40.0")
+            value=ROI_THRESHOLD
         )
         
         filtered_page = analysis_repo.list_filtered(
@@ -144,8 +220,7 @@ class TestSmokeLocal:
         
         # Devrait retourner ISBN001 (45.5%) et ISBN003 (67.8%)
         assert filtered_page.total == 2
-        high_roi_isbns = {item.isbn_or_asin for item in filtered_page.items}
-        assert high_roi_isbns == {"ISBN001", "ISBN003"}
+        assert {item.isbn_or_asin for item in filtered_page.items} == ISBNS_001_003
         
         # ✅ STEP 6: Test ISBN list filtering (PATCH 1)
         isbn_page = analysis_repo.list_filtered(
@@ -154,8 +229,7 @@ class TestSmokeLocal:
         )
         
         assert isbn_page.total == 2
-        isbn_filtered = {item.isbn_or_asin for item in isbn_page.items}
-        assert isbn_filtered == {"ISBN001", "ISBN002"}
+        assert {item.isbn_or_asin for item in isbn_page.items} == ISBNS_001_002
         
         # ✅ STEP 7: Test sorting par velocity_score desc (PATCH 2)
         sorted_page = analysis_repo.list_filtered(
@@ -173,11 +247,13 @@ class TestSmokeLocal:
         # ✅ STEP 8: Test top_n_for_batch strategies (PATCH 3)
         
         # ROI strategy - ISBN003 first (67.8%)
-        top_roi = analysis_repo.top_n_for_batch(
-            batch_id=batch.id,
-            strategy="roi",
-            limit=2
-        )
+        with count_queries(db_session.connection()) as queries:
+            top_roi = analysis_repo.top_n_for_batch(
+                batch_id=batch.id,
+                strategy="roi",
+                limit=2
+            )
+        assert len(queries) <= 1
         assert len(top_roi) == 2
         assert top_roi[0].isbn_or_asin == "ISBN003"  # 67.8% ROI
         
@@ -195,21 +271,31 @@ class TestSmokeLocal:
         # ISBN002: 32.1 * 0.6 + 58.9 * 0.4 = 19.26 + 23.56 = 42.82
         # ISBN003: 67.8 * 0.6 + 41.2 * 0.4 = 40.68 + 16.48 = 57.16
         # Ordre: ISBN003 (57.16), ISBN001 (56.22), ISBN002 (42.82)
-        top_balanced = analysis_repo.top_n_for_batch(
-            batch_id=batch.id,
-            strategy="balanced",
-            limit=3
-        )
+        with count_queries(db_session.connection()) as queries:
+            top_balanced = analysis_repo.top_n_for_batch(
+                batch_id=batch.id,
+                strategy="balanced",
+                limit=3
+            )
+        # Score calculé et LIMIT côté SQL (index d'expression), pas de tri Python
+        assert len(queries) == 1
+        top_sql = queries[0].lower()
+        assert "order by analyses.roi_percent * 0.6 + analyses.velocity_score * 0.4 desc" in top_sql, top_sql
+        assert "limit ?" in top_sql
         assert len(top_balanced) == 3
         assert top_balanced[0].isbn_or_asin == "ISBN003"  # Highest balanced score
         
-        # ✅ STEP 9: Test count_by_thresholds
-        thresholds = analysis_repo.count_by_thresholds(
-            batch_id=batch.id,
-            roi_threshold=Decimal("40.0"),
-            velocity_threshold=Decimal("60.0"),
-            profit_threshold=Decimal("15.0")
-        )
+        # ✅ STEP 9: Test count_by_thresholds (un seul agrégat)
+        with count_queries(db_session.connection()) as queries:
+            thresholds = analysis_repo.count_by_thresholds(
+                batch_id=batch.id,
+                roi_threshold=ROI_THRESHOLD,
+                velocity_threshold=VELOCITY_THRESHOLD,
+                profit_threshold=PROFIT_THRESHOLD
+            )
+        assert len(queries) == 1
+        assert queries[0].lower().count("select") == 1
+        assert queries[0].lower().count("sum(case") == 4
         
         assert thresholds["total"] == 3
         assert thresholds["high_roi"] == 2  # ISBN001, ISBN003
@@ -226,40 +312,143 @@ class TestSmokeLocal:
         
         assert deleted_count == 1
         
-        # Vérifier suppression
-        remaining_page = analysis_repo.list_filtered(batch_id=batch.id)
-        assert remaining_page.total == 2
-        remaining_isbns = {item.isbn_or_asin for item in remaining_page.items}
-        assert remaining_isbns == {"ISBN002", "ISBN003"}  # ISBN001 supprimé
+        # Vérifier suppression (une seule projection des ISBN, sans pagination)
+        remaining_isbns = select(Analysis.isbn_or_asin).where(Analysis.batch_id == batch.id)
+        assert set(db_session.scalars(remaining_isbns)) == ISBNS_002_003  # ISBN001 supprimé
         
         # Delete all remaining by batch
         deleted_batch_count = analysis_repo.delete_by_batch(batch.id)
         assert deleted_batch_count == 2
         
         # Vérifier batch vide
-        empty_page = analysis_repo.list_filtered(batch_id=batch.id)
-        assert empty_page.total == 0
-        assert len(empty_page.items) == 0
+        assert db_session.scalars(remaining_isbns).all() == []
         
         print("✅ SMOKE TEST COMPLET - Tous les workflows validés !")
         
-    def test_patch4_duplicate_detection(self, db_session):
-        """Test PATCH 4: DuplicateIsbnInBatchError detection"""
+    def test_list_filtered_no_lazy_loads(self, db_session):
+        """raiseload("*") : les colonnes de la page sont chargées, toute relation lève"""
         
-        # Créer batch
-        batch = Batch(name="Duplicate Test", status=BatchStatus.RUNNING)
+        batch = Batch(name="Raiseload Test", status=BatchStatus.RUNNING)
         db_session.add(batch)
-        db_session.commit()
+        db_session.flush()
         
-        analysis_repo = AnalysisRepository(db_session)
+        db_session.execute(insert(Analysis), [
+            {"batch_id": batch.id, "isbn_or_asin": "ISBN001", "roi_percent": Decimal("45.5")},
+            {"batch_id": batch.id, "isbn_or_asin": "ISBN002", "roi_percent": Decimal("32.1")}
+        ])
         
-        # Créer première analyse
-        analysis1 = analysis_repo.create_analysis(
+        analysis_repo = AnalysisRepository(db_session)
+        page = analysis_repo.list_filtered(
             batch_id=batch.id,
-            isbn_or_asin="TESTISBN001",
-            roi_percent=Decimal("25.0")
+            page=1,
+            page_size=10,
+            load_options=[raiseload("*")]
+        )
+        
+        assert page.total == 2
+        assert all(item.isbn_or_asin and item.roi_percent is not None for item in page.items)
+        
+        with pytest.raises(InvalidRequestError):
+            page.items[0].batch
+        
+    def test_list_filtered_keyset_no_count(self, db_session):
+        """Keyset : WHERE (velocity_score, id) < (?, ?), ni COUNT ni OFFSET"""
+        
+        batch = Batch(name="Keyset Test", status=BatchStatus.RUNNING)
+        db_session.add(batch)
+        db_session.flush()
+        
+        db_session.execute(insert(Analysis), [
+            {"batch_id": batch.id, "isbn_or_asin": f"ISBN{i:03d}", "velocity_score": Decimal(i % 7)}
+            for i in range(25)
+        ])
+        
+        analysis_repo = AnalysisRepository(db_session)
+        first = analysis_repo.list_filtered(
+            batch_id=batch.id, sort_by="velocity_score", sort_desc=True, page_size=10
+        )
+        last = first.items[-1]
+        
+        with count_queries(db_session.connection()) as queries:
+            second = analysis_repo.list_filtered(
+                batch_id=batch.id,
+                sort_by="velocity_score",
+                sort_desc=True,
+                page_size=10,
+                after=(last.velocity_score, last.id)
+            )
+        
+        assert len(queries) == 1, queries
+        page_sql = queries[0].lower()
+        assert "count(" not in page_sql, page_sql
+        # SQLite rend toujours "LIMIT ? OFFSET ?" (offset lié à 0) : c'est le
+        # seek sur (velocity_score, id) qui reprend après le curseur
+        assert "(analyses.velocity_score, analyses.id) <" in page_sql, page_sql
+        
+        assert second.total is None
+        assert len(second.items) == 10
+        assert second.has_next
+        # Suite exacte de la première page : aucun doublon, ordre conservé
+        assert not {a.id for a in first.items} & {a.id for a in second.items}
+        assert (second.items[0].velocity_score, second.items[0].id) < (last.velocity_score, last.id)
+        
+    def test_list_filtered_count_query_shape(self, db_session):
+        """Total : SELECT count(*) nu, sans ORDER BY ni sous-requête anon"""
+        
+        batch = Batch(name="Count Shape Test", status=BatchStatus.RUNNING)
+        db_session.add(batch)
+        db_session.flush()
+        
+        db_session.execute(insert(Analysis), [
+            {"batch_id": batch.id, "isbn_or_asin": f"ISBN{i:03d}", "roi_percent": Decimal(i)}
+            for i in range(3)
+        ])
+        
+        analysis_repo = AnalysisRepository(db_session)
+        with count_queries(db_session.connection()) as queries:
+            page = analysis_repo.list_filtered(
+                batch_id=batch.id, sort_by="roi_percent", sort_desc=True, page_size=2
+            )
+        
+        assert page.total == 3
+        count_stmts = [q.lower() for q in queries if q.lower().startswith("select count")]
+        assert len(count_stmts) == 1, queries
+        count_sql = count_stmts[0]
+        assert "order by" not in count_sql
+        assert "anon_1" not in count_sql
+        assert count_sql.count("select") == 1
+        assert "where analyses.batch_id = ?" in count_sql
+        
+    @pytest.mark.parametrize("strategy, index_name", [
+        ("roi", "idx_analyses_batch_roi_desc"),
+        ("velocity", "idx_analyses_batch_velocity_desc"),
+    ])
+    def test_top_n_uses_batch_sort_index(self, db_session, strategy, index_name):
+        """Top-N : parcours de l'index (batch_id, score DESC, id DESC), pas de tri du batch"""
+        
+        batch = Batch(name="Index Test", status=BatchStatus.RUNNING)
+        db_session.add(batch)
+        db_session.flush()
+        
+        db_session.execute(insert(Analysis), [
+            {"batch_id": batch.id, "isbn_or_asin": isbn, "roi_percent": roi, "velocity_score": velocity}
+            for isbn, _title, roi, velocity, *_rest in _ANALYSES_DATA
+        ])
+        
+        analysis_repo = AnalysisRepository(db_session)
+        plan = explain_query_plan(
+            db_session.connection(),
+            lambda: analysis_repo.top_n_for_batch(batch_id=batch.id, strategy=strategy, limit=2)
         )
-        db_session.commit()
+        
+        assert index_name in plan, plan
+        # Ordre de l'index = ORDER BY complet (départage id inclus) : aucun tri
+        assert "USE TEMP B-TREE" not in plan, plan
+        
+    def test_patch4_duplicate_detection(self, batch_with_one_analysis):
+        """Test PATCH 4: DuplicateIsbnInBatchError detection"""
+        
+        batch, analysis_repo = batch_with_one_analysis
         
         # Tenter de créer duplicate - devrait lever exception
         from backend.app.repositories.base import DuplicateIsbnInBatchError